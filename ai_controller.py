@@ -5,11 +5,10 @@ import user_config
 
 
 def set_enable_ai_processing(user_id: int, enabled: bool):
-    stored_config = user_config.load_user_config(user_id)
+    def change(stored_config: user_config.UserConfig):
+        stored_config.ai_enabled = enabled
 
-    stored_config.ai_enabled = enabled
-
-    user_config.save_user_config(user_id, stored_config)
+    user_config.update_user_config(user_id, change)
 
 
 async def enable_ai(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -0,0 +1,163 @@
+import io
+import os
+from typing import Optional
+
+import av
+import numpy as np
+from faster_whisper.audio import decode_audio
+from faster_whisper.vad import VadOptions, get_speech_timestamps
+
+import config
+from const import AUDIO_CACHE_DIR, AUDIO_DIR
+
+# What Whisper expects, so the model never has to resample
+SAMPLE_RATE = 16000
+
+
+def settings_key() -> str:
+    """
+    Describes the preprocessing settings, for cache keys. Changing a threshold changes what Whisper hears.
+    """
+    if not config.AUDIO_PREPROCESS:
+        return "raw"
+    if not config.VAD_ENABLED:
+        return "pcm"
+    return (f"vad-{config.VAD_THRESHOLD}-{config.VAD_MIN_SILENCE_MS}-"
+            f"{config.VAD_SPEECH_PAD_MS}-{config.VAD_MIN_SPEECH_MS}")
+
+
+def decoded_cache_path(audio_path: str) -> Optional[str]:
+    """
+    Where the decoded copy of a file under AUDIO_DIR is kept: the same layout under AUDIO_CACHE_DIR, as .npy.
+    The cache lives outside AUDIO_DIR so /processaudio and /backfill only ever see voice notes.
+    """
+    relative = os.path.relpath(os.path.abspath(audio_path), os.path.abspath(AUDIO_DIR))
+    if relative.startswith(".."):
+        return None
+    return os.path.join(AUDIO_CACHE_DIR, relative + ".npy")
+
+
+def duration(audio_path: str) -> Optional[float]:
+    """
+    The file's length in seconds from its container header, without decoding it. None if the header doesn't say.
+    """
+    try:
+        with av.open(audio_path) as container:
+            if container.duration is not None:
+                return container.duration / av.time_base
+    except av.error.FFmpegError as e:
+        print(f"[Preprocess] Couldn't read the length of {audio_path}: {e}")
+    return None
+
+
+def decode(audio_path: str, data: Optional[bytes] = None) -> np.ndarray:
+    """
+    Decodes the file to 16 kHz mono float32 PCM, reusing the decoded copy if an earlier run saved one.
+
+    `data` is the file's contents when they are already in memory, such as a voice note that was just
+    downloaded and is still being written to `audio_path`. It is decoded straight from memory and nothing
+    is read from or written to disk.
+    """
+    if data is not None:
+        return decode_audio(io.BytesIO(data), sampling_rate=SAMPLE_RATE)
+
+    cache_path = decoded_cache_path(audio_path) if config.AUDIO_CACHE_DECODED else None
+
+    if cache_path and os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(audio_path):
+        try:
+            # Memory-mapped, so only the pages Whisper reads are loaded
+            audio = np.load(cache_path, mmap_mode="r")
+            # Mark it recently used so it's evicted last
+            os.utime(cache_path)
+            return audio
+        except (OSError, ValueError) as e:
+            print(f"[Preprocess] Ignoring unreadable {cache_path}: {e}")
+
+    audio = decode_audio(audio_path, sampling_rate=SAMPLE_RATE)
+
+    if cache_path:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = cache_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, audio)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"[Preprocess] Failed to save {cache_path}: {e}")
+        else:
+            evict_decoded_cache(keep=cache_path)
+
+    return audio
+
+
+def evict_decoded_cache(keep: Optional[str] = None):
+    """
+    Deletes the least recently used decoded files until the cache fits in AUDIO_CACHE_MAX_MB.
+    `keep` is never deleted, even if it doesn't fit on its own.
+    """
+    entries = []
+    for directory, _, filenames in os.walk(AUDIO_CACHE_DIR):
+        for filename in filenames:
+            if not filename.endswith(".npy"):
+                continue
+            path = os.path.join(directory, filename)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                # Another worker evicted it first
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    excess = sum(size for _, size, _ in entries) - config.AUDIO_CACHE_MAX_MB * 1024 * 1024
+    for _, size, path in sorted(entries):
+        if excess <= 0:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        excess -= size
+
+
+def speech_timestamps(audio: np.ndarray) -> list[tuple[int, int]]:
+    """
+    The (start, end) sample ranges the VAD thinks are speech, padded by VAD_SPEECH_PAD_MS on each side.
+    """
+    options = VadOptions(threshold=config.VAD_THRESHOLD,
+                         min_silence_duration_ms=config.VAD_MIN_SILENCE_MS,
+                         speech_pad_ms=config.VAD_SPEECH_PAD_MS,
+                         min_speech_duration_ms=config.VAD_MIN_SPEECH_MS)
+
+    return [(chunk["start"], chunk["end"])
+            for chunk in get_speech_timestamps(audio, options, sampling_rate=SAMPLE_RATE)]
+
+
+def remove_silence(audio: np.ndarray) -> np.ndarray:
+    """
+    Keeps only the stretches the VAD thinks are speech.
+    """
+    speech = speech_timestamps(audio)
+    if not speech:
+        return np.zeros(0, dtype=np.float32)
+
+    return np.concatenate([audio[start:end] for start, end in speech])
+
+
+def preprocess(audio_path: str, data: Optional[bytes] = None):
+    """
+    Returns what to hand Whisper for this file: 16 kHz PCM with the silence cut out, or the file itself
+    when AUDIO_PREPROCESS is off. `data` is as for decode().
+    """
+    if not config.AUDIO_PREPROCESS:
+        return audio_path if data is None else io.BytesIO(data)
+
+    audio = decode(audio_path, data)
+    if not config.VAD_ENABLED:
+        return audio
+
+    speech = remove_silence(audio)
+    print(f"[Preprocess] {os.path.basename(audio_path)}: {len(audio) / SAMPLE_RATE:.1f}s of audio, "
+          f"{len(speech) / SAMPLE_RATE:.1f}s of speech")
+    return speech
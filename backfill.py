@@ -0,0 +1,218 @@
+"""
+Finds a user's voice notes that were never transcribed and runs them through the pipeline.
+
+Used by the /backfill command, or offline with:
+    python backfill.py [--full] <user_id> [<user_id> ...]
+Offline runs only transcribe unless --full is given, which also stylises and runs plugins,
+reporting to the console instead of Telegram.
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+import config
+import user_config
+from const import AUDIO_DIR, CONFIG_PATH, TRANSCRIPTION_DIR
+from file_index import extract_timestamp
+from processes import write_transcription
+from transcribe import transcribe_voice_async
+from transcription_cache import cache, hash_file
+from transcription_queue import get_queue, QueueFullError
+
+BACKFILL_STATE_FILE = Path(CONFIG_PATH + "/backfill_state.json")
+AUDIO_EXTENSIONS = (".ogg", ".oga", ".opus", ".mp3", ".m4a", ".wav")
+
+_state_lock = threading.Lock()
+
+
+class BackfillRunningError(RuntimeError):
+    pass
+
+
+# Users with a backfill in progress, so the same files aren't picked up twice
+running_users: set[int] = set()
+
+
+def _load_state() -> dict[str, list[str]]:
+    if not BACKFILL_STATE_FILE.exists():
+        return {}
+    try:
+        return json.loads(BACKFILL_STATE_FILE.read_text())
+    except json.JSONDecodeError:
+        return {}
+
+
+def mark_processed(user_id: int, audio_filename: str):
+    with _state_lock:
+        state = _load_state()
+        done = state.setdefault(str(user_id), [])
+        if audio_filename not in done:
+            done.append(audio_filename)
+
+        tmp_file = BACKFILL_STATE_FILE.with_suffix(".tmp")
+        tmp_file.write_text(json.dumps(state))
+        os.replace(tmp_file, BACKFILL_STATE_FILE)
+
+
+def find_unprocessed_audio(user_id: int) -> list[str]:
+    """
+    Returns paths of the user's voice notes with no transcription, oldest first.
+
+    A note counts as transcribed if a backfill already finished it, or if a transcription was
+    written after it was received and before the next note came in. Notes already in the
+    transcription cache are only recognised once backfill_user hashes them.
+    """
+    audio_directory = os.path.join(AUDIO_DIR, str(user_id))
+    transcription_directory = os.path.join(TRANSCRIPTION_DIR, str(user_id))
+
+    if not os.path.isdir(audio_directory):
+        return []
+
+    audio_files = sorted((f for f in os.listdir(audio_directory) if f.lower().endswith(AUDIO_EXTENSIONS)),
+                         key=extract_timestamp)
+
+    transcription_times = []
+    if os.path.isdir(transcription_directory):
+        transcription_times = sorted(extract_timestamp(f) for f in os.listdir(transcription_directory))
+
+    done = set(_load_state().get(str(user_id), []))
+    unprocessed = []
+
+    for i, filename in enumerate(audio_files):
+        if filename in done:
+            continue
+
+        received = extract_timestamp(filename)
+        next_received = extract_timestamp(audio_files[i + 1]) if i + 1 < len(audio_files) else float("inf")
+
+        position = bisect.bisect_left(transcription_times, received)
+        if position < len(transcription_times) and transcription_times[position] < next_received:
+            continue
+
+        unprocessed.append(os.path.join(audio_directory, filename))
+
+    return unprocessed
+
+
+async def transcribe_for_backfill(user_id: int, audio_path: str,
+                                  model_size: Optional[str]) -> tuple[Optional[str], bool]:
+    """
+    Transcribes through the shared queue unless the transcription cache already has the note.
+
+    Returns (transcription_path, cached). A cached note went through the pipeline when it was sent,
+    so it is already done. transcription_path is None if there was no speech in the note.
+    """
+    audio_hash = await asyncio.to_thread(hash_file, audio_path)
+    cache_key = cache.make_key(user_id, audio_hash, model_size)
+
+    cached = cache.get(cache_key)
+    if cached:
+        return cached, True
+
+    while True:
+        try:
+            job, _ = get_queue().submit(user_id, lambda: transcribe_voice_async(audio_path, model_size))
+            break
+        except QueueFullError:
+            # Leave room for people sending new notes, try again shortly
+            await asyncio.sleep(5)
+
+    text = await job
+    if not text.strip():
+        return None, False
+
+    transcription_path = await asyncio.to_thread(write_transcription, user_id, text)
+    cache.put(cache_key, transcription_path)
+
+    return transcription_path, False
+
+
+async def backfill_user(user_id: int,
+                        on_progress: Callable[[int, int, int], Awaitable],
+                        on_transcribed: Optional[Callable[[str, str], Awaitable]] = None) -> tuple[int, int]:
+    """
+    Processes every unprocessed voice note for the user, BACKFILL_CONCURRENCY at a time.
+
+    on_transcribed(audio_path, transcription_path) runs the rest of the pipeline for a note.
+    A note is only marked done once that succeeds, so an interrupted backfill picks up where it stopped.
+    on_progress(done, failed, total) is called after every note. Returns (done, failed).
+    Raises BackfillRunningError if the user already has a backfill running.
+    """
+    if user_id in running_users:
+        raise BackfillRunningError("A backfill is already running for this user.")
+
+    running_users.add(user_id)
+    try:
+        files = find_unprocessed_audio(user_id)
+        model_size = user_config.load_user_config(user_id).whisper_model
+        semaphore = asyncio.Semaphore(config.BACKFILL_CONCURRENCY)
+        counts = {"done": 0, "failed": 0}
+
+        async def process(audio_path: str):
+            async with semaphore:
+                try:
+                    transcription_path, cached = await transcribe_for_backfill(user_id, audio_path, model_size)
+                    if cached:
+                        # Written up when it was sent, running the pipeline again would duplicate the entry
+                        print(f"[Backfill] {audio_path} was already transcribed, skipping")
+                    elif transcription_path is None:
+                        # Nothing to write up, and nothing will change if it's transcribed again
+                        print(f"[Backfill] No speech in {audio_path}, skipping")
+                    elif on_transcribed is not None:
+                        await on_transcribed(audio_path, transcription_path)
+                    await asyncio.to_thread(mark_processed, user_id, os.path.basename(audio_path))
+                    counts["done"] += 1
+                except Exception as e:
+                    print(f"[Backfill] Failed to process {audio_path}: {e}")
+                    counts["failed"] += 1
+
+                await on_progress(counts["done"], counts["failed"], len(files))
+
+        await asyncio.gather(*(process(path) for path in files))
+
+        return counts["done"], counts["failed"]
+    finally:
+        running_users.discard(user_id)
+
+
+async def _main(user_ids: list[int], full: bool):
+    if full:
+        import plugin_core
+        from processes import transcribed_file_to_diary
+        from reporting import ConsoleReporter
+
+        plugin_core.load_plugins(None)
+
+    for user_id in user_ids:
+        async def report(done: int, failed: int, total: int):
+            print(f"[Backfill] User {user_id}: {done + failed}/{total} ({failed} failed)")
+
+        on_transcribed = None
+        if full:
+            reporter = ConsoleReporter(user_id)
+
+            async def write_diary(audio_path: str, transcription_path: str):
+                await transcribed_file_to_diary(reporter, audio_path=audio_path, transcription_path=transcription_path)
+
+            on_transcribed = write_diary
+
+        done, failed = await backfill_user(user_id, on_progress=report, on_transcribed=on_transcribed)
+        print(f"[Backfill] User {user_id} finished: {done} processed, {failed} failed")
+
+    if full:
+        await plugin_core.shutdown_plugins()
+    user_config.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transcribe voice notes that were never transcribed.")
+    parser.add_argument("user_ids", nargs="+", type=int, help="Telegram user IDs to backfill")
+    parser.add_argument("--full", action="store_true", help="Also stylise the entries and run plugins")
+    args = parser.parse_args()
+
+    asyncio.run(_main(args.user_ids, args.full))
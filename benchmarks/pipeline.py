@@ -0,0 +1,455 @@
+"""
+End-to-end benchmark for the voice note -> diary pipeline.
+
+Each voice note goes through the real handle_voice, with a stub Telegram bot, a fake LLM with a fixed
+latency and a local fake Journiv server, so only the parts we control are measured. Audio fixtures
+are synthetic WAVs, and every note is slightly different so the transcription cache never hits.
+
+    python benchmarks/pipeline.py --models tiny,base --concurrency 1,4,8 --notes 16 --output results.json
+
+Whisper models are real unless --fake-whisper-rtf is given, which replaces transcription with a sleep
+of audio length * RTF. Compare two saved runs with --compare old.json.
+
+The benchmark works in a temporary directory, so the bot's own config/ is never touched.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import wave
+from collections import defaultdict
+from pathlib import Path
+from types import SimpleNamespace
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_RATE = 16000
+STAGES = ("download", "transcribe", "stylise", "plugins", "total")
+
+
+def write_fixture(path: str, seconds: float, seed: int):
+    """
+    Writes a 16 kHz mono WAV of speech-like noise: a few drifting tones, gated into syllables.
+    """
+    rng = random.Random(seed)
+    tones = [rng.uniform(120, 300) * (i + 1) for i in range(3)]
+    frames = bytearray()
+
+    for n in range(int(seconds * SAMPLE_RATE)):
+        t = n / SAMPLE_RATE
+        syllable = max(0.0, math.sin(2 * math.pi * 3.0 * t))
+        sample = sum(math.sin(2 * math.pi * f * t) for f in tones) / len(tones)
+        sample = syllable * sample * 0.6 + rng.uniform(-0.02, 0.02)
+        frames += struct.pack("<h", int(sample * 32767))
+
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(frames)
+
+
+def make_unique(fixture: str, path: str, index: int):
+    """
+    Copies the fixture with a few extra samples at the end so every note hashes differently.
+    """
+    with wave.open(fixture, "rb") as source:
+        params = source.getparams()
+        frames = source.readframes(source.getnframes())
+
+    with wave.open(path, "wb") as f:
+        f.setparams(params)
+        f.writeframes(frames + struct.pack("<q", index))
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, math.ceil(p / 100 * len(ordered)) - 1)
+    return ordered[rank]
+
+
+class Timings:
+    def __init__(self):
+        self.stages: dict[str, list[float]] = defaultdict(list)
+
+    def timed(self, stage: str, func):
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.stages[stage].append(time.perf_counter() - started)
+        return wrapper
+
+    def summary(self) -> dict:
+        return {
+            stage: {
+                "count": len(values),
+                "p50": round(percentile(values, 50), 4),
+                "p95": round(percentile(values, 95), 4),
+                "mean": round(sum(values) / len(values), 4) if values else 0.0,
+            }
+            for stage, values in self.stages.items()
+        }
+
+
+class StubMessage:
+    """
+    Enough of a Telegram Message for the pipeline. Every API call costs `latency` seconds.
+    """
+
+    def __init__(self, chat_id: int, latency: float, voice=None):
+        self.chat = SimpleNamespace(id=chat_id)
+        self.voice = voice
+        self.latency = latency
+
+    async def reply_text(self, text, **kwargs):
+        await asyncio.sleep(self.latency)
+        return StubMessage(self.chat.id, self.latency)
+
+    async def edit_text(self, text, **kwargs):
+        await asyncio.sleep(self.latency)
+
+    async def reply_document(self, document, **kwargs):
+        document.read()
+        await asyncio.sleep(self.latency)
+
+
+class StubFile:
+    def __init__(self, source: str, timings: Timings, latency: float):
+        self.source = source
+        self.download_to_drive = timings.timed("download", self._download)
+        self.download_as_bytearray = timings.timed("download", self._download_to_memory)
+        self.latency = latency
+
+    async def _download(self, path):
+        await asyncio.sleep(self.latency)
+        await asyncio.to_thread(shutil.copyfile, self.source, path)
+
+    async def _download_to_memory(self):
+        await asyncio.sleep(self.latency)
+        return bytearray(await asyncio.to_thread(Path(self.source).read_bytes))
+
+
+class StubBot:
+    def __init__(self, timings: Timings, latency: float, download_latency: float):
+        self.timings = timings
+        self.latency = latency
+        self.download_latency = download_latency
+
+    async def get_file(self, file_id):
+        await asyncio.sleep(self.latency)
+        return StubFile(file_id, self.timings, self.download_latency)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latency)
+
+
+class FakeChatModel:
+    """
+    Stands in for a LangChain chat model, answering after `latency` seconds.
+    Streaming spreads the same latency over a handful of chunks.
+    """
+
+    def __init__(self, latency: float, chunks: int = 10):
+        self.latency = latency
+        self.chunks = chunks
+
+    async def ainvoke(self, prompt):
+        await asyncio.sleep(self.latency)
+        return SimpleNamespace(content="Dear diary, " + prompt[-200:])
+
+    async def astream(self, prompt):
+        for i in range(self.chunks):
+            await asyncio.sleep(self.latency / self.chunks)
+            yield SimpleNamespace(content=f"chunk {i} ")
+
+
+class FakeWhisperModel:
+    def __init__(self, rtf: float):
+        self.rtf = rtf
+
+    def transcribe(self, audio, **kwargs):
+        # Decoded PCM from the preprocessing stage, or the file itself when that's turned off
+        if hasattr(audio, "shape"):
+            seconds = audio.shape[0] / SAMPLE_RATE
+        else:
+            with wave.open(audio, "rb") as f:
+                seconds = f.getnframes() / f.getframerate()
+        time.sleep(seconds * self.rtf)
+        return iter([SimpleNamespace(start=0.0, end=seconds, text=f"Transcription of {seconds:.1f}s of audio")]), None
+
+
+async def start_fake_journiv(latency: float):
+    """
+    Serves the Journiv endpoints the plugin uses on a random local port. Returns (runner, base_url).
+    """
+    from aiohttp import web
+
+    async def login(request):
+        await asyncio.sleep(latency)
+        return web.json_response({"access_token": "benchmark", "refresh_token": "benchmark", "expires_in": 3600})
+
+    async def create_entry(request):
+        body = await request.json()
+        await asyncio.sleep(latency)
+        return web.json_response({"id": str(uuid.uuid4()), "journal_id": body["journal_id"]})
+
+    async def upload_media(request):
+        reader = await request.multipart()
+        async for part in reader:
+            await part.read()
+        await asyncio.sleep(latency)
+        return web.json_response({"id": str(uuid.uuid4())})
+
+    app = web.Application(client_max_size=1024 ** 3)
+    app.router.add_post("/api/v1/auth/login", login)
+    app.router.add_post("/api/v1/entries/", create_entry)
+    app.router.add_post("/api/v1/media/upload", upload_media)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def run_level(args, fixture: str, model_size: str, concurrency: int, first_user_id: int,
+                    journiv_url: str) -> dict:
+    import handlers
+    import plugin_core
+    import processes
+    import user_config
+
+    timings = Timings()
+    bot = StubBot(timings, args.telegram_latency, args.download_latency)
+
+    # Stage hooks. processes looks these up through its own globals, so patch them there.
+    processes.transcribe_to_file = timings.timed("transcribe", original["transcribe_to_file"])
+    processes.generate_diary_entry = timings.timed("stylise", original["generate_diary_entry"])
+    plugin_core.run_plugins = timings.timed("plugins", original["run_plugins"])
+    handle_voice = timings.timed("total", handlers.handle_voice)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one_note(index: int):
+        # A user per note so the fair queue and the cache treat every note as independent
+        user_id = first_user_id + index
+        user_config.save_user_config(user_id, user_config.UserConfig(ai_enabled=True, reminder_time=None,
+                                                                     whisper_model=model_size))
+        plugin_core.save_user_config(user_id, "journiv", {
+            "base_url": journiv_url, "email": f"{user_id}@example.com", "password": "benchmark",
+            "journal_id": "benchmark",
+        })
+
+        audio_path = os.path.join(args.workdir, f"note_{user_id}.wav")
+        await asyncio.to_thread(make_unique, fixture, audio_path, user_id)
+
+        voice = SimpleNamespace(file_id=audio_path, duration=int(args.audio_seconds))
+        message = StubMessage(user_id, args.telegram_latency, voice=voice)
+        update = SimpleNamespace(message=message, effective_user=SimpleNamespace(id=user_id))
+
+        async with semaphore:
+            await handle_voice(update, SimpleNamespace(bot=bot))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_note(i) for i in range(args.notes)))
+    wall = time.perf_counter() - started
+
+    return {
+        "model": model_size,
+        "concurrency": concurrency,
+        "notes": args.notes,
+        "wall_seconds": round(wall, 3),
+        "throughput_per_minute": round(args.notes / wall * 60, 2),
+        "stages": timings.summary(),
+    }
+
+
+original = {}
+
+
+async def run(args) -> dict:
+    import config
+    import diary_writer
+    import outbox
+    import plugin_core
+    import processes
+    import transcribe
+    from plugins.journiv import JournivPlugin
+
+    original.update(transcribe_to_file=processes.transcribe_to_file,
+                    generate_diary_entry=processes.generate_diary_entry,
+                    run_plugins=plugin_core.run_plugins)
+
+    fake_llm = FakeChatModel(args.llm_latency)
+    diary_writer.get_chat_model = lambda *_: fake_llm
+
+    if args.fake_whisper_rtf is not None:
+        fake_whisper = FakeWhisperModel(args.fake_whisper_rtf)
+        transcribe.get_model = lambda *_: fake_whisper
+
+    fixture = os.path.join(args.workdir, "fixture.wav")
+    await asyncio.to_thread(write_fixture, fixture, args.audio_seconds, args.seed)
+
+    runner, journiv_url = await start_fake_journiv(args.journiv_latency)
+    plugin_core.plugins = [JournivPlugin()] if args.journiv else []
+    outbox.start_worker(StubBot(Timings(), args.telegram_latency, 0), plugin_core.deliver)
+
+    results = []
+    first_user_id = 1_000_000
+    try:
+        for model_size in args.models:
+            # Load the model before the clock starts, that's a one-off cost
+            await asyncio.get_running_loop().run_in_executor(transcribe.get_executor(),
+                                                             transcribe.get_model, model_size)
+
+            for concurrency in args.concurrency:
+                result = await run_level(args, fixture, model_size, concurrency, first_user_id, journiv_url)
+                first_user_id += args.notes
+                results.append(result)
+                print_result(result)
+    finally:
+        await outbox.stop_worker()
+        await plugin_core.shutdown_plugins()
+        transcribe.shutdown_executor()
+        await runner.cleanup()
+
+    return {
+        "created_at": datetime.datetime.now().astimezone().isoformat(),
+        "commit": git_commit(),
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "settings": {
+            "audio_seconds": args.audio_seconds,
+            "llm_latency": args.llm_latency,
+            "journiv_latency": args.journiv_latency,
+            "telegram_latency": args.telegram_latency,
+            "download_latency": args.download_latency,
+            "fake_whisper_rtf": args.fake_whisper_rtf,
+            "transcribe_executor": config.TRANSCRIBE_EXECUTOR,
+            "transcribe_workers": config.TRANSCRIBE_WORKERS,
+            "whisper_compute_type": config.WHISPER_COMPUTE_TYPE,
+            "ai_streaming": config.AI_STREAMING,
+            "transcribe_streaming": config.TRANSCRIBE_STREAMING,
+        },
+        "results": results,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def print_result(result: dict):
+    print(f"\n[Benchmark] model={result['model']} concurrency={result['concurrency']} "
+          f"notes={result['notes']} wall={result['wall_seconds']}s "
+          f"throughput={result['throughput_per_minute']}/min")
+    for stage in STAGES:
+        if stage in result["stages"]:
+            s = result["stages"][stage]
+            print(f"  {stage:<11} p50 {s['p50']:8.3f}s   p95 {s['p95']:8.3f}s   n={s['count']}")
+
+
+def compare(previous: dict, current: dict):
+    """
+    Prints how p95 moved for every stage present in both runs.
+    """
+    old = {(r["model"], r["concurrency"]): r for r in previous["results"]}
+
+    print(f"\n[Benchmark] Compared with {previous.get('commit') or 'previous run'} (p95, + is slower)")
+    for result in current["results"]:
+        before = old.get((result["model"], result["concurrency"]))
+        if before is None:
+            continue
+
+        changes = []
+        for stage in STAGES:
+            if stage in result["stages"] and stage in before["stages"]:
+                was, now = before["stages"][stage]["p95"], result["stages"][stage]["p95"]
+                change = (now - was) / was * 100 if was else 0.0
+                changes.append(f"{stage} {change:+.0f}%")
+
+        print(f"  model={result['model']} concurrency={result['concurrency']}: " + ", ".join(changes))
+
+
+def parse_list(text: str, cast=str) -> list:
+    return [cast(item.strip()) for item in text.split(",") if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the voice note to diary pipeline.")
+    parser.add_argument("--models", default="base", help="Comma separated Whisper model sizes (default: base)")
+    parser.add_argument("--concurrency", default="1,4", help="Comma separated concurrency levels (default: 1,4)")
+    parser.add_argument("--notes", type=int, default=8, help="Voice notes per concurrency level (default: 8)")
+    parser.add_argument("--audio-seconds", type=float, default=15.0, help="Length of each voice note (default: 15)")
+    parser.add_argument("--llm-latency", type=float, default=2.0, help="Seconds the fake LLM takes (default: 2)")
+    parser.add_argument("--journiv-latency", type=float, default=0.05,
+                        help="Seconds each fake Journiv request takes (default: 0.05)")
+    parser.add_argument("--telegram-latency", type=float, default=0.05,
+                        help="Seconds each stub Telegram call takes (default: 0.05)")
+    parser.add_argument("--download-latency", type=float, default=0.2,
+                        help="Seconds the voice note download takes (default: 0.2)")
+    parser.add_argument("--fake-whisper-rtf", type=float, default=None,
+                        help="Replace Whisper with a sleep of audio length * this. Forces the thread executor")
+    parser.add_argument("--no-journiv", dest="journiv", action="store_false", help="Run without the Journiv plugin")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the synthetic audio")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="A previous results file to compare against")
+    args = parser.parse_args()
+
+    args.models = parse_list(args.models)
+    args.concurrency = parse_list(args.concurrency, int)
+    output = os.path.abspath(args.output) if args.output else None
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+
+    # Settings are read when config is imported, so they go in first
+    if args.fake_whisper_rtf is not None:
+        # A patched model doesn't reach spawned worker processes
+        os.environ["TRANSCRIBE_EXECUTOR"] = "thread"
+    os.environ.setdefault("TRANSCRIBE_QUEUE_DEPTH", str(max(args.notes, 50)))
+    os.environ.setdefault("WHISPER_WARM_UP", "false")
+    # The synthetic notes aren't speech as far as the VAD is concerned
+    os.environ.setdefault("VAD_ENABLED", "false")
+
+    # Everything the bot writes goes to config/ under the working directory
+    args.workdir = tempfile.mkdtemp(prefix="diary-bench-")
+    os.chdir(args.workdir)
+    sys.path.insert(0, REPO_ROOT)
+
+    try:
+        report = asyncio.run(run(args))
+    finally:
+        shutil.rmtree(args.workdir, ignore_errors=True)
+
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n[Benchmark] Results saved to {output}")
+
+    if previous:
+        compare(previous, report)
+
+
+if __name__ == "__main__":
+    main()
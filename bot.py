@@ -1,19 +1,23 @@
 import os
-from datetime import datetime
 
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from telegram import BotCommand
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackQueryHandler
 
+import config
+import metrics
+import outbox
 import plugin_core
+import scheduler
+import user_config
 from ai_controller import enable_ai, disable_ai
 from callback_handler import handle_audio_process_callback, handle_transcription_process_callback, \
     handle_audio_page_callback, handle_transcription_page_callback
+from commands.backfill import backfill
 from commands.process_audio import process_audio
 from commands.process_transcription import process_transcription
 from config import TELEGRAM_TOKEN
-from handlers import start, handle_voice, setstyle, setreminder, getstyle
-from scheduler import schedule_reminders
+from handlers import start, handle_voice, setstyle, setreminder, getstyle, setmodel, removereminder, settimezone
+from transcribe import shutdown_executor, warm_up_async
 
 
 async def set_bot_commands(application):
@@ -21,11 +25,15 @@ async def set_bot_commands(application):
         BotCommand("start", "Start the bot"),
         BotCommand("setstyle", "Set your diary style"),
         BotCommand("setreminder", "Set daily reminder time"),
+        BotCommand("removereminder", "Stop your daily reminder"),
+        BotCommand("settimezone", "Set the time zone for your reminders"),
         BotCommand("getstyle", "Retrieve the style you have set for the bot"),
         BotCommand("processaudio", "Process an already send audio file. Used as backup"),
         BotCommand("processtranscription", "Process an already existing transcription. Used as backup"),
         BotCommand("disableai", "Disable the AI processing of your entries"),
         BotCommand("enableai", "Enable the AI processing of your entries"),
+        BotCommand("setmodel", "Choose the transcription model for your voice notes"),
+        BotCommand("backfill", "Process all your voice notes that were never transcribed"),
     ]
 
     for command in plugin_core.get_loaded_plugin_commands():
@@ -33,33 +41,61 @@ async def set_bot_commands(application):
 
     await application.bot.set_my_commands(commands)
 
+    if config.WHISPER_WARM_UP:
+        application.create_task(warm_up_async())
 
-# Create config folder
-CONFIG_FOLDER = os.getcwd() + "/config"
-os.makedirs(CONFIG_FOLDER, exist_ok=True)
+    outbox.start_worker(application.bot, plugin_core.deliver)
+    await metrics.start_server()
+    scheduler.start(application.bot)
 
-app = Application.builder().token(TELEGRAM_TOKEN).post_init(set_bot_commands).build()
-app.add_handler(CommandHandler("start", start))
-app.add_handler(MessageHandler(filters.VOICE, handle_voice))
-app.add_handler(CommandHandler("setstyle", setstyle))
-app.add_handler(CommandHandler("setreminder", setreminder))
-app.add_handler(CommandHandler("getstyle", getstyle))
-app.add_handler(CommandHandler("processaudio", process_audio))
-app.add_handler(CallbackQueryHandler(handle_audio_process_callback, pattern="^audio_process"))
-app.add_handler(CallbackQueryHandler(handle_transcription_process_callback, pattern="^transcription_process"))
-app.add_handler(CallbackQueryHandler(handle_audio_page_callback, pattern="^audio_page"))
-app.add_handler(CallbackQueryHandler(handle_transcription_page_callback, pattern="^transcription_page"))
-app.add_handler(CommandHandler("processtranscription", process_transcription))
-app.add_handler(CommandHandler("enableai", enable_ai))
-app.add_handler(CommandHandler("disableai", disable_ai))
 
-plugin_core.load_plugins(app)
+async def on_shutdown(application):
+    await scheduler.shutdown()
+    await metrics.stop_server()
+    await outbox.stop_worker()
+    await plugin_core.shutdown_plugins()
+    shutdown_executor()
+    user_config.flush()
 
-system_timezone = datetime.now().astimezone().tzinfo
-scheduler = AsyncIOScheduler(timezone=system_timezone)
-scheduler.start()
-schedule_reminders(scheduler, app.bot)
 
-print("Bot started.")
+def main():
+    # Create config folder
+    CONFIG_FOLDER = os.getcwd() + "/config"
+    os.makedirs(CONFIG_FOLDER, exist_ok=True)
 
-app.run_polling()
+    # Handle updates concurrently so one user's long transcription doesn't hold up everyone else
+    app = (Application.builder()
+           .token(TELEGRAM_TOKEN)
+           .concurrent_updates(True)
+           .post_init(set_bot_commands)
+           .post_shutdown(on_shutdown)
+           .build())
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(MessageHandler(filters.VOICE, handle_voice))
+    app.add_handler(CommandHandler("setstyle", setstyle))
+    app.add_handler(CommandHandler("setreminder", setreminder))
+    app.add_handler(CommandHandler("removereminder", removereminder))
+    app.add_handler(CommandHandler("settimezone", settimezone))
+    app.add_handler(CommandHandler("getstyle", getstyle))
+    app.add_handler(CommandHandler("processaudio", process_audio))
+    app.add_handler(CallbackQueryHandler(handle_audio_process_callback, pattern="^audio_process"))
+    app.add_handler(CallbackQueryHandler(handle_transcription_process_callback, pattern="^transcription_process"))
+    app.add_handler(CallbackQueryHandler(handle_audio_page_callback, pattern="^audio_page"))
+    app.add_handler(CallbackQueryHandler(handle_transcription_page_callback, pattern="^transcription_page"))
+    app.add_handler(CommandHandler("processtranscription", process_transcription))
+    app.add_handler(CommandHandler("enableai", enable_ai))
+    app.add_handler(CommandHandler("disableai", disable_ai))
+    app.add_handler(CommandHandler("setmodel", setmodel))
+    app.add_handler(CommandHandler("backfill", backfill))
+
+    plugin_core.load_plugins(app)
+
+    print("Bot started.")
+
+    app.run_polling()
+
+
+# Worker processes of the transcription pool are spawned and import this module again as __mp_main__,
+# they must not start a second copy of the bot
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Runs a directory of audio files through the same pipeline as voice notes sent to the bot, without Telegram.
+
+    python bulk_process.py <directory> --user-id <id> [--workers N] [--no-ai | --ai] [--no-plugins]
+
+Transcriptions are written to TRANSCRIPTION_DIR/<user_id>/ just as the bot writes them, and the
+transcription cache is shared, so files the bot already transcribed are skipped. Transcription runs
+on a pool of worker processes, one per core by default. Plugin deliveries that can't be made headless
+(e.g. Journiv) wait in the outbox and are sent the next time the bot starts.
+"""
+import argparse
+import asyncio
+import os
+import time
+
+
+def _configure(workers: int):
+    """
+    Points the transcription settings at a process pool before config is imported.
+    Anything already set in the environment wins.
+    """
+    os.environ.setdefault("TRANSCRIBE_EXECUTOR", "process")
+    os.environ.setdefault("TRANSCRIBE_WORKERS", str(workers))
+    os.environ.setdefault("TRANSCRIBE_QUEUE_DEPTH", str(workers * 2))
+    # One model per worker, so split the cores between them rather than every worker using them all
+    os.environ.setdefault("WHISPER_CPU_THREADS", str(max(1, (os.cpu_count() or 1) // workers)))
+
+
+async def _main(args):
+    import outbox
+    import plugin_core
+    import transcribe
+    import user_config
+    from backfill import AUDIO_EXTENSIONS
+    from processes import audio_file_to_diary
+    from reporting import ConsoleReporter
+
+    files = sorted((os.path.join(args.directory, f) for f in os.listdir(args.directory)
+                    if f.lower().endswith(AUDIO_EXTENSIONS)),
+                   key=os.path.getmtime)
+
+    if not files:
+        print(f"[Bulk] No audio files in {args.directory}")
+        return
+
+    if not args.no_plugins:
+        plugin_core.load_plugins(None)
+
+    # Keep every worker busy without going over the transcription queue's depth
+    semaphore = asyncio.Semaphore(args.workers * 2)
+    counts = {"done": 0, "skipped": 0, "failed": 0}
+    started = time.monotonic()
+
+    async def process(path: str):
+        async with semaphore:
+            try:
+                diary = await audio_file_to_diary(ConsoleReporter(args.user_id, label=os.path.basename(path)), path,
+                                                  stylise=args.ai, run_plugins=not args.no_plugins)
+            except Exception as e:
+                print(f"[Bulk] Failed to process {path}: {e}")
+                counts["failed"] += 1
+            else:
+                # The reporter has already said why (no speech, queue full, already in progress)
+                counts["done" if diary is not None else "skipped"] += 1
+
+            print(f"[Bulk] {sum(counts.values())}/{len(files)} processed")
+
+    print(f"[Bulk] Processing {len(files)} files with {args.workers} workers")
+    try:
+        await asyncio.gather(*(process(path) for path in files))
+    finally:
+        await plugin_core.shutdown_plugins()
+        transcribe.shutdown_executor()
+        user_config.flush()
+
+    print(f"[Bulk] Finished in {time.monotonic() - started:.0f}s: "
+          f"{counts['done']} processed, {counts['skipped']} skipped, {counts['failed']} failed")
+
+    pending = outbox.store.pending_count()
+    if pending:
+        print(f"[Bulk] {pending} plugin deliveries are waiting in the outbox for the bot to send")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transcribe and process a directory of audio files.")
+    parser.add_argument("directory", help="Directory containing the audio files")
+    parser.add_argument("--user-id", type=int, required=True,
+                        help="Telegram user ID the files belong to. Picks the output directory and the user's settings")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Transcription processes to run (default: one per core)")
+    ai = parser.add_mutually_exclusive_group()
+    ai.add_argument("--ai", dest="ai", action="store_true", default=None,
+                    help="Stylise entries with AI even if the user has it disabled")
+    ai.add_argument("--no-ai", dest="ai", action="store_false",
+                    help="Don't stylise entries, even if the user has AI enabled")
+    parser.add_argument("--no-plugins", action="store_true", help="Only transcribe and stylise, don't run plugins")
+    parser.set_defaults(ai=None)
+    args = parser.parse_args()
+    args.workers = max(1, args.workers)
+
+    _configure(args.workers)
+    asyncio.run(_main(args))
@@ -2,7 +2,10 @@ import os
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 
+from file_index import get_index, FileFilter
+
 ITEMS_PER_PAGE = 5
+MAX_FILTER_LENGTH = 30  # bytes
 
 
 async def send_file_buttons(
@@ -11,28 +14,21 @@ async def send_file_buttons(
         file_emoji: str,
         directory: str,
         callback_prefix: str,
-        page: int = 1
+        page: int = 1,
+        filter_text: str = ""
 ):
     if not os.path.exists(directory):
         await update_or_query.message.reply_text("❌ No files found.")
         return
 
-    files = [f for f in os.listdir(directory)]
-
-    def extract_timestamp(filename):
-        try:
-            return int(filename.rsplit("_", 1)[-1].split(".")[0])
-        except:
-            return 0
-
-    files.sort(key=extract_timestamp, reverse=True)
+    # Keep the filter short enough to fit in Telegram's 64 byte callback data
+    filter_text = filter_text.strip().encode("utf-8")[:MAX_FILTER_LENGTH].decode("utf-8", errors="ignore")
 
-    total_pages = (len(files) - 1) // ITEMS_PER_PAGE + 1
-    page = max(1, min(page, total_pages))
+    page_files, page, total_pages = get_index(directory).page(page, ITEMS_PER_PAGE, FileFilter.parse(filter_text))
 
-    start = (page - 1) * ITEMS_PER_PAGE
-    end = start + ITEMS_PER_PAGE
-    page_files = files[start:end]
+    if not page_files:
+        await update_or_query.message.reply_text("❌ No files found.")
+        return
 
     buttons = [[
         InlineKeyboardButton(f"{file_emoji} {f}", callback_data=f"{callback_prefix}_process|{f}")
@@ -40,9 +36,11 @@ async def send_file_buttons(
 
     nav_buttons = []
     if page > 1:
-        nav_buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"{callback_prefix}_page|{page - 1}"))
+        nav_buttons.append(InlineKeyboardButton("⬅️ Prev",
+                                                callback_data=f"{callback_prefix}_page|{page - 1}|{filter_text}"))
     if page < total_pages:
-        nav_buttons.append(InlineKeyboardButton("➡️ Next", callback_data=f"{callback_prefix}_page|{page + 1}"))
+        nav_buttons.append(InlineKeyboardButton("➡️ Next",
+                                                callback_data=f"{callback_prefix}_page|{page + 1}|{filter_text}"))
     if nav_buttons:
         buttons.append(nav_buttons)
 
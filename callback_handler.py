@@ -31,8 +31,8 @@ async def handle_audio_page_callback(update: Update, context: ContextTypes.DEFAU
     prefix, extra = data.split("|", 1)
 
     if prefix == "audio_page":
-        page = int(extra)
-        await send_audio_buttons(query, query.from_user.id, page)
+        page, _, filter_text = extra.partition("|")
+        await send_audio_buttons(query, query.from_user.id, int(page), filter_text)
 
 
 async def handle_transcription_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -41,5 +41,5 @@ async def handle_transcription_page_callback(update: Update, context: ContextTyp
     prefix, extra = data.split("|", 1)
 
     if prefix == "transcription_page":
-        page = int(extra)
-        await send_transcription_buttons(query, query.from_user.id, page)
+        page, _, filter_text = extra.partition("|")
+        await send_transcription_buttons(query, query.from_user.id, int(page), filter_text)
@@ -0,0 +1,45 @@
+from telegram import Update
+from telegram.ext import ContextTypes
+
+import backfill as backfill_runner
+from live_message import LiveMessage
+from processes import transcribed_file_to_diary
+from reporting import TelegramReporter
+
+
+async def backfill(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    send_transcripts = "transcripts" in (context.args or [])
+
+    if user_id in backfill_runner.running_users:
+        await update.message.reply_text("⏳ A backfill is already running for you.")
+        return
+
+    files = backfill_runner.find_unprocessed_audio(user_id)
+    if not files:
+        await update.message.reply_text("✅ All your voice notes have been transcribed already.")
+        return
+
+    status = LiveMessage(update.message)
+    await status.update(f"🔁 Backfilling {len(files)} voice notes...", force=True)
+
+    async def on_progress(done: int, failed: int, total: int):
+        await status.update(f"🔁 Backfill: {done + failed}/{total} processed, {failed} failed")
+
+    reporter = TelegramReporter(update.message)
+
+    async def on_transcribed(audio_path: str, transcription_path: str):
+        if send_transcripts:
+            await reporter.send_file(transcription_path, caption="📝 Backfilled transcription")
+
+        await transcribed_file_to_diary(reporter, audio_path=audio_path, transcription_path=transcription_path)
+
+    try:
+        done, failed = await backfill_runner.backfill_user(user_id, on_progress, on_transcribed)
+    except backfill_runner.BackfillRunningError:
+        # Another /backfill got in while this one was posting its status
+        await status.finish("⏳ A backfill is already running for you.")
+        return
+
+    await status.finish(f"✅ Backfill finished: {done} processed, {failed} failed."
+                        + (" Run /backfill again to retry the failed ones." if failed else ""))
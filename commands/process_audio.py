@@ -6,9 +6,10 @@ from telegram.ext import ContextTypes
 from button_helper import send_file_buttons
 from const import AUDIO_DIR
 from processes import audio_file_to_diary
+from reporting import TelegramReporter
 
 
-async def send_audio_buttons(update_or_query, user_id, page: int):
+async def send_audio_buttons(update_or_query, user_id, page: int, filter_text: str = ""):
     user_audio_directory = os.path.join(AUDIO_DIR, str(user_id))
 
     await send_file_buttons(update_or_query,
@@ -16,12 +17,13 @@ async def send_audio_buttons(update_or_query, user_id, page: int):
                             file_emoji="🎧",
                             directory=user_audio_directory,
                             callback_prefix="audio",
-                            page=page)
+                            page=page,
+                            filter_text=filter_text)
 
 
 async def process_audio(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
-    await send_audio_buttons(update, user_id, 1)
+    await send_audio_buttons(update, user_id, 1, " ".join(context.args or []))
 
 
 async def handle_audio_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -37,4 +39,4 @@ async def handle_audio_callback(update: Update, context: ContextTypes.DEFAULT_TY
         await query.edit_message_text("❌ File not found.")
         return
 
-    await audio_file_to_diary(query.message, path)
+    await audio_file_to_diary(TelegramReporter(query.message), path)
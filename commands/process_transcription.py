@@ -6,9 +6,10 @@ from telegram.ext import ContextTypes
 from button_helper import send_file_buttons
 from const import TRANSCRIPTION_DIR
 from processes import transcribed_file_to_diary
+from reporting import TelegramReporter
 
 
-async def send_transcription_buttons(update_or_query, user_id, page: int):
+async def send_transcription_buttons(update_or_query, user_id, page: int, filter_text: str = ""):
     user_transcription_directory = os.path.join(TRANSCRIPTION_DIR, str(user_id))
 
     await send_file_buttons(update_or_query=update_or_query,
@@ -16,12 +17,13 @@ async def send_transcription_buttons(update_or_query, user_id, page: int):
                             file_emoji="📄",
                             directory=user_transcription_directory,
                             callback_prefix="transcription",
-                            page=page)
+                            page=page,
+                            filter_text=filter_text)
 
 
 async def process_transcription(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
-    await send_transcription_buttons(update, user_id, 1)
+    await send_transcription_buttons(update, user_id, 1, " ".join(context.args or []))
 
 
 async def handle_transcription_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -37,4 +39,4 @@ async def handle_transcription_callback(update: Update, context: ContextTypes.DE
         await query.edit_message_text("❌ File not found.")
         return
 
-    await transcribed_file_to_diary(query.message, audio_path=None, transcription_path=path)
\ No newline at end of file
+    await transcribed_file_to_diary(TelegramReporter(query.message), audio_path=None, transcription_path=path)
\ No newline at end of file
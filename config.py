@@ -10,6 +10,22 @@ def get_float_env(var_name, default):
         return default
 
 
+def get_bool_env(var_name, default):
+    value = os.getenv(var_name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def get_int_env(var_name, default):
+    try:
+        value = os.getenv(var_name)
+        return int(value) if value is not None else default
+    except (ValueError, TypeError):
+        print(f"There was an error parsing {var_name}")
+        return default
+
+
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 
 """
@@ -20,3 +36,98 @@ openai
 AI_PROVIDER = os.getenv("AI_PROVIDER")
 AI_MODEL = os.getenv("AI_MODEL")
 AI_TEMPERATURE = get_float_env("AI_TEMPERATURE", 0.7)
+
+# Seconds to wait for a single LLM response before retrying
+AI_TIMEOUT = get_float_env("AI_TIMEOUT", 60.0)
+AI_MAX_RETRIES = max(0, get_int_env("AI_MAX_RETRIES", 2))
+AI_RETRY_BASE_DELAY = get_float_env("AI_RETRY_BASE_DELAY", 1.0)
+AI_MAX_CONCURRENCY = max(1, get_int_env("AI_MAX_CONCURRENCY", 4))
+
+# Edit one message with the diary entry as the AI writes it. Once it's done plugins deliver the entry as usual.
+AI_STREAMING = get_bool_env("AI_STREAMING", True)
+
+"""
+Where transcription runs. "thread" shares one loaded model between worker threads,
+"process" loads a model per worker process and uses more RAM but more cores.
+"""
+TRANSCRIBE_EXECUTOR = os.getenv("TRANSCRIBE_EXECUTOR", "thread").lower()
+TRANSCRIBE_WORKERS = max(1, get_int_env("TRANSCRIBE_WORKERS", 2))
+# How many voice notes can wait for a transcription worker before new ones are turned away
+TRANSCRIBE_QUEUE_DEPTH = max(1, get_int_env("TRANSCRIBE_QUEUE_DEPTH", 50))
+
+# Download voice notes into memory and transcribe from there, saving the copy in AUDIO_DIR in the background
+VOICE_DOWNLOAD_TO_MEMORY = get_bool_env("VOICE_DOWNLOAD_TO_MEMORY", True)
+
+# Edit one message with the transcript as it's produced instead of waiting for the whole note
+TRANSCRIBE_STREAMING = get_bool_env("TRANSCRIBE_STREAMING", True)
+
+# Minimum seconds between edits of a live-updating message
+LIVE_EDIT_INTERVAL = get_float_env("LIVE_EDIT_INTERVAL", 3.0)
+
+"""
+Whisper model settings. See faster-whisper for the supported sizes and compute types.
+Smaller models and int8 trade accuracy for throughput.
+"""
+WHISPER_MODEL = os.getenv("WHISPER_MODEL", "base")
+WHISPER_DEVICE = os.getenv("WHISPER_DEVICE", "cpu")
+WHISPER_COMPUTE_TYPE = os.getenv("WHISPER_COMPUTE_TYPE", "int8")
+WHISPER_CPU_THREADS = get_int_env("WHISPER_CPU_THREADS", 0)  # 0 lets CTranslate2 decide
+WHISPER_NUM_WORKERS = max(1, get_int_env("WHISPER_NUM_WORKERS", 1))
+
+# Load the default model in the background at startup instead of on the first voice note
+WHISPER_WARM_UP = get_bool_env("WHISPER_WARM_UP", True)
+
+# Model sizes users may pick for themselves with /setmodel
+WHISPER_ALLOWED_MODELS = [m.strip() for m in os.getenv("WHISPER_ALLOWED_MODELS", WHISPER_MODEL).split(",") if m.strip()]
+
+"""
+Audio is decoded to 16 kHz mono once (and kept under config/audio_cache), then the VAD cuts out
+silence before Whisper sees it. Thresholds are passed to faster-whisper's Silero VAD.
+"""
+AUDIO_PREPROCESS = get_bool_env("AUDIO_PREPROCESS", True)
+AUDIO_CACHE_DECODED = get_bool_env("AUDIO_CACHE_DECODED", True)
+# Decoded audio is about 20 times the size of the voice note, least recently used files go past this many MB
+AUDIO_CACHE_MAX_MB = max(0, get_int_env("AUDIO_CACHE_MAX_MB", 1024))
+VAD_ENABLED = get_bool_env("VAD_ENABLED", True)
+VAD_THRESHOLD = get_float_env("VAD_THRESHOLD", 0.5)
+VAD_MIN_SILENCE_MS = get_int_env("VAD_MIN_SILENCE_MS", 2000)
+VAD_SPEECH_PAD_MS = get_int_env("VAD_SPEECH_PAD_MS", 400)
+VAD_MIN_SPEECH_MS = get_int_env("VAD_MIN_SPEECH_MS", 250)
+
+"""
+Voice notes longer than LONG_AUDIO_SECONDS are cut at their pauses into chunks of up to LONG_AUDIO_CHUNK_SECONDS
+that are transcribed side by side on the transcription pool. 0 turns it off, and it needs AUDIO_PREPROCESS.
+It only kicks in when chunks can really run at once: TRANSCRIBE_EXECUTOR=process with more than one worker,
+or with threads (which share one model) WHISPER_NUM_WORKERS above 1 as well.
+"""
+LONG_AUDIO_SECONDS = get_float_env("LONG_AUDIO_SECONDS", 300.0)
+LONG_AUDIO_CHUNK_SECONDS = max(30.0, get_float_env("LONG_AUDIO_CHUNK_SECONDS", 120.0))
+
+# How many audio files the transcription cache remembers before evicting the least recently used
+TRANSCRIPTION_CACHE_SIZE = max(1, get_int_env("TRANSCRIPTION_CACHE_SIZE", 1000))
+
+# Seconds to wait after a user config change before writing the file, so bursts of changes become one write
+USER_CONFIG_FLUSH_DELAY = get_float_env("USER_CONFIG_FLUSH_DELAY", 2.0)
+
+"""
+Where user configs, plugin configs and styles are stored. 
+sqlite (default) - config/storage.db, existing JSON/style files are imported on first start
+json - the original user_config.json, plugin_config.json and styles/ files
+"""
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite").lower()
+
+# How many voice notes a /backfill works on at once
+BACKFILL_CONCURRENCY = max(1, get_int_env("BACKFILL_CONCURRENCY", 2))
+
+# Port for the Prometheus metrics endpoint (GET /metrics). 0 turns it off.
+METRICS_PORT = get_int_env("METRICS_PORT", 0)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Reminders are sent at most this many a second across all users (Telegram allows about 30)
+REMINDER_RATE = max(0.1, get_float_env("REMINDER_RATE", 25.0))
+# Seconds between two messages to the same chat (Telegram allows about 1 a second)
+REMINDER_CHAT_INTERVAL = get_float_env("REMINDER_CHAT_INTERVAL", 1.0)
+REMINDER_SEND_WORKERS = max(1, get_int_env("REMINDER_SEND_WORKERS", 8))
+REMINDER_MAX_ATTEMPTS = max(1, get_int_env("REMINDER_MAX_ATTEMPTS", 3))
+# Minutes of reminders caught up on after the bot was down
+REMINDER_CATCH_UP_MINUTES = max(0, get_int_env("REMINDER_CATCH_UP_MINUTES", 30))
@@ -3,4 +3,7 @@ import os
 CONFIG_PATH = os.getcwd() + "/config"
 
 AUDIO_DIR = CONFIG_PATH + "/audio"
-TRANSCRIPTION_DIR = CONFIG_PATH + "/transcriptions"
\ No newline at end of file
+TRANSCRIPTION_DIR = CONFIG_PATH + "/transcriptions"
+STYLE_DIR = CONFIG_PATH + "/styles"
+# Decoded copies of voice notes, laid out like AUDIO_DIR
+AUDIO_CACHE_DIR = CONFIG_PATH + "/audio_cache"
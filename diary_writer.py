@@ -1,12 +1,103 @@
-import os
+import asyncio
+import random
+from functools import lru_cache
+from typing import Awaitable, Callable, Optional
+
 from langchain.chat_models import init_chat_model
 
 import config
+import metrics
+import storage
+
+# Caps how many LLM calls are in flight at once across all users
+_llm_semaphore = asyncio.Semaphore(config.AI_MAX_CONCURRENCY)
+
+LLM_SECONDS = metrics.Histogram("diary_llm_request_seconds", "Time each LLM attempt takes", labels=("result",))
+LLM_IN_FLIGHT = metrics.Gauge("diary_llm_in_flight", "LLM requests running now")
+
+# Rate limits, timeouts and server-side failures, which can go away on their own
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+# Matched by name so the provider SDKs stay optional: openai/httpx, then google-api-core
+TRANSIENT_ERROR_NAMES = {
+    "APIConnectionError", "APITimeoutError", "RateLimitError", "InternalServerError",
+    "TimeoutException", "NetworkError", "RemoteProtocolError",
+    "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded", "TooManyRequests", "BadGateway", "GatewayTimeout",
+}
+
+
+@lru_cache(maxsize=None)
+def get_chat_model(provider: str, model: str, temperature: float):
+    """
+    One long-lived client per provider/model/temperature so its HTTP connection pool is reused between entries.
+    """
+    print(f"[DiaryWriter] Creating chat model {provider}/{model}")
+    return init_chat_model(model=model, model_provider=provider, temperature=temperature)
 
-STYLE_DIR = os.getcwd() + "/config/styles"
+
+def _chunk_text(chunk) -> str:
+    # Most providers stream plain strings, some send a list of content blocks
+    if isinstance(chunk.content, str):
+        return chunk.content
+    return "".join(block.get("text", "") for block in chunk.content if isinstance(block, dict))
+
+
+async def _stream_response(model, prompt: str, on_text: Callable[[str], Awaitable]) -> str:
+    text = ""
+    async for chunk in model.astream(prompt):
+        text += _chunk_text(chunk)
+        await on_text(text)
+    return text
+
+
+async def _invoke_response(model, prompt: str) -> str:
+    response = await model.ainvoke(prompt)
+    return response.content
 
 
-def generate_diary_entry(raw_text: str, user_id: int) -> str:
+def is_transient(error: Exception) -> bool:
+    """
+    Whether a failed LLM call is worth retrying. Auth, validation and other client errors never are.
+    """
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if isinstance(status, int):
+        return status in TRANSIENT_STATUS_CODES
+
+    return any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(error).__mro__)
+
+
+async def invoke_with_retry(prompt: str, on_text: Optional[Callable[[str], Awaitable]] = None) -> str:
+    """
+    Sends the prompt to the configured model and returns the response text.
+    When on_text is given the response is streamed and on_text is called with the text so far after every chunk.
+    An attempt that fails with a transient error is retried from scratch, anything else is raised straight away.
+    """
+    model = get_chat_model(config.AI_PROVIDER, config.AI_MODEL, config.AI_TEMPERATURE)
+
+    for attempt in range(config.AI_MAX_RETRIES + 1):
+        try:
+            async with _llm_semaphore:
+                if on_text is not None:
+                    call = _stream_response(model, prompt, on_text)
+                else:
+                    call = _invoke_response(model, prompt)
+
+                with LLM_IN_FLIGHT.track(), LLM_SECONDS.time():
+                    return await asyncio.wait_for(call, timeout=config.AI_TIMEOUT)
+        except Exception as e:
+            if attempt == config.AI_MAX_RETRIES or not is_transient(e):
+                raise
+
+            # Exponential backoff with full jitter
+            delay = random.uniform(0, config.AI_RETRY_BASE_DELAY * (2 ** attempt))
+            print(f"[DiaryWriter] LLM call failed ({type(e).__name__}: {e}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def generate_diary_entry(raw_text: str, user_id: int,
+                               on_text: Optional[Callable[[str], Awaitable]] = None) -> str:
     user_style = get_user_style(user_id)
 
     prompt = (
@@ -18,22 +109,15 @@ def generate_diary_entry(raw_text: str, user_id: int) -> str:
         f'{raw_text}'
     )
 
-    model = init_chat_model(model=config.AI_MODEL, model_provider=config.AI_PROVIDER, temperature=config.AI_TEMPERATURE)
-
-    response = model.invoke(prompt)
-    return response.content
+    return await invoke_with_retry(prompt, on_text=on_text)
 
 
 def set_user_style(user_id: int, style: str):
-    os.makedirs(STYLE_DIR, exist_ok=True)
-    path = os.path.join(STYLE_DIR, f"user_{user_id}_style.txt")
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(style)
+    storage.get_backend().save_style(user_id, style)
 
 
 def get_user_style(user_id: int) -> str:
-    path = os.path.join(STYLE_DIR, f"user_{user_id}_style.txt")
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            return f.read()
+    style = storage.get_backend().get_style(user_id)
+    if style is not None:
+        return style
     return "The user has not set a style. Use a thoughtful and personal tone."
@@ -0,0 +1,134 @@
+import bisect
+import datetime
+import os
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
+
+def extract_timestamp(filename: str) -> int:
+    try:
+        return int(filename.rsplit("_", 1)[-1].split(".")[0])
+    except:
+        return 0
+
+
+@dataclass
+class FileFilter:
+    since: Optional[int] = None
+    until: Optional[int] = None
+    search: Optional[str] = None
+
+    @classmethod
+    def parse(cls, text: str) -> "FileFilter":
+        """
+        "2024-05-01" shows that day onwards, "2024-05-01 2024-05-31" a date range,
+        anything else is matched against the filenames.
+        """
+        parts = text.split()
+        if not parts:
+            return cls()
+
+        try:
+            dates = [datetime.datetime.strptime(p, "%Y-%m-%d") for p in parts[:2]]
+        except ValueError:
+            return cls(search=text.strip().lower())
+
+        since = int(dates[0].timestamp())
+        until = int((dates[1] + datetime.timedelta(days=1)).timestamp()) if len(dates) > 1 else None
+        return cls(since=since, until=until)
+
+
+class FileIndex:
+    """
+    A directory's files sorted by the timestamp at the end of their names.
+
+    Built once with a single listdir, then kept up to date with add(). If the directory changes
+    behind our back (its mtime moves) the index is rebuilt on next use.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        # (timestamp, filename) in ascending order
+        self._entries: list[tuple[int, str]] = []
+        self._mtime: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _directory_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _refresh(self):
+        mtime = self._directory_mtime()
+        if mtime == self._mtime:
+            return
+
+        files = os.listdir(self.directory) if mtime is not None else []
+        self._entries = sorted((extract_timestamp(f), f) for f in files)
+        self._mtime = mtime
+
+    def add(self, filename: str):
+        with self._lock:
+            if self._mtime is None:
+                # Never built, the first lookup will pick the file up
+                return
+
+            entry = (extract_timestamp(filename), filename)
+            position = bisect.bisect_left(self._entries, entry)
+            if position == len(self._entries) or self._entries[position] != entry:
+                self._entries.insert(position, entry)
+
+            self._mtime = self._directory_mtime()
+
+    def page(self, page: int, per_page: int, file_filter: FileFilter = None) -> tuple[list[str], int, int]:
+        """
+        Returns the files on the given page (newest first), the clamped page number and the total page count.
+        """
+        file_filter = file_filter or FileFilter()
+
+        with self._lock:
+            self._refresh()
+
+            # Date ranges are a bisect on the sorted timestamps
+            lo = 0 if file_filter.since is None else bisect.bisect_left(self._entries, (file_filter.since, ""))
+            hi = len(self._entries) if file_filter.until is None else bisect.bisect_left(self._entries,
+                                                                                         (file_filter.until, ""))
+
+            if file_filter.search:
+                matches = [e for e in self._entries[lo:hi] if file_filter.search in e[1].lower()]
+                lo, hi, entries = 0, len(matches), matches
+            else:
+                entries = self._entries
+
+            total = max(0, hi - lo)
+            total_pages = max(1, (total - 1) // per_page + 1)
+            page = max(1, min(page, total_pages))
+
+            # Newest first, so count pages back from the end of the range
+            end = hi - (page - 1) * per_page
+            start = max(lo, end - per_page)
+            files = [filename for _, filename in reversed(entries[start:end])]
+
+            return files, page, total_pages
+
+
+_indexes: dict[str, FileIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index(directory: str) -> FileIndex:
+    directory = os.path.abspath(directory)
+
+    with _indexes_lock:
+        if directory not in _indexes:
+            _indexes[directory] = FileIndex(directory)
+        return _indexes[directory]
+
+
+def record_file(path: str):
+    """
+    Tell the index for the file's directory about a file we just wrote.
+    """
+    get_index(os.path.dirname(path)).add(os.path.basename(path))
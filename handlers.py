@@ -1,13 +1,20 @@
 import datetime
 import os
+from typing import Optional
 
 from telegram import Update
 from telegram.ext import ContextTypes
 
+import config
+import long_audio
+import metrics
+import user_config
 from const import AUDIO_DIR
 from diary_writer import set_user_style, get_user_style
+from file_index import record_file
 from processes import audio_file_to_diary
-from scheduler import save_reminder, schedule_reminders
+from reporting import TelegramReporter
+from scheduler import parse_timezone, save_reminder, save_timezone
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -16,7 +23,6 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     voice = update.message.voice
-    file = await context.bot.get_file(voice.file_id)
 
     user_id = update.effective_user.id
 
@@ -27,11 +33,32 @@ async def handle_voice(update: Update, context: ContextTypes.DEFAULT_TYPE):
     audio_filename = f"{formatted_date}_{timestamp}.ogg"
 
     path = os.path.join(AUDIO_DIR, str(user_id), audio_filename)
+
+    if download_to_memory(voice.duration):
+        # Transcription starts from memory, the copy in AUDIO_DIR is written alongside it
+        with metrics.STAGE_SECONDS.time(stage="download"):
+            file = await context.bot.get_file(voice.file_id)
+            data = bytes(await file.download_as_bytearray())
+
+        await audio_file_to_diary(TelegramReporter(update.message), path, data=data)
+        return
+
     os.makedirs(os.path.dirname(path), exist_ok=True)
 
-    await file.download_to_drive(path)
+    with metrics.STAGE_SECONDS.time(stage="download"):
+        file = await context.bot.get_file(voice.file_id)
+        await file.download_to_drive(path)
+    record_file(path)
 
-    await audio_file_to_diary(update.message, path)
+    await audio_file_to_diary(TelegramReporter(update.message), path)
+
+
+def download_to_memory(duration: Optional[int]) -> bool:
+    if not config.VOICE_DOWNLOAD_TO_MEMORY:
+        return False
+
+    # Long notes are split into chunks that each worker reads from disk, so they need the file first
+    return not (long_audio.enabled() and config.LONG_AUDIO_SECONDS <= (duration or 0))
 
 
 async def setstyle(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -69,10 +96,43 @@ async def setreminder(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     save_reminder(user_id, time_str)
 
-    # Reschedule this user's job
-    schedule_reminders(context.application.job_queue.scheduler, context.bot)
+    timezone = user_config.load_user_config(user_id).timezone or "the bot's local time"
+    await update.message.reply_text(f"✅ Your daily reminder is set for {time_str} ({timezone}).")
+
+
+async def removereminder(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+
+    if not user_config.load_user_config(user_id).reminder_time:
+        await update.message.reply_text("You don't have a reminder set.")
+        return
+
+    save_reminder(user_id, None)
+    await update.message.reply_text("🔕 Your daily reminder has been removed.")
 
-    await update.message.reply_text(f"✅ Your daily reminder is set for {time_str}.")
+
+async def settimezone(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+
+    if not context.args:
+        current = user_config.load_user_config(user_id).timezone or "the bot's local time"
+        await update.message.reply_text(f"🌍 Your reminders use {current}.\n"
+                                        f"Usage: /settimezone <Area/City>, e.g. /settimezone Europe/London\n"
+                                        f"Use /settimezone default to go back to the bot's local time.")
+        return
+
+    name = context.args[0].strip()
+    if name.lower() == "default":
+        save_timezone(user_id, None)
+        await update.message.reply_text("✅ Your reminders now use the bot's local time.")
+        return
+
+    if parse_timezone(name) is None:
+        await update.message.reply_text("❌ Unknown time zone. Use a name like Europe/London or America/New_York.")
+        return
+
+    save_timezone(user_id, name)
+    await update.message.reply_text(f"✅ Your reminders now use {name}.")
 
 
 async def getstyle(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -81,3 +141,29 @@ async def getstyle(update: Update, context: ContextTypes.DEFAULT_TYPE):
     style = get_user_style(user_id)
 
     await update.message.reply_text(f"{style}")
+
+
+async def setmodel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    stored_config = user_config.load_user_config(user_id)
+    current = stored_config.whisper_model or config.WHISPER_MODEL
+    options = ", ".join(config.WHISPER_ALLOWED_MODELS)
+
+    if not context.args:
+        await update.message.reply_text(f"🎙 Your transcription model is `{current}`.\n"
+                                        f"Usage: /setmodel <model>\nAvailable: {options}",
+                                        parse_mode="Markdown")
+        return
+
+    model_size = context.args[0].strip()
+    if model_size not in config.WHISPER_ALLOWED_MODELS:
+        await update.message.reply_text(f"❌ Unknown model. Available: {options}")
+        return
+
+    def change(cfg: user_config.UserConfig):
+        cfg.whisper_model = model_size
+
+    user_config.update_user_config(user_id, change)
+
+    await update.message.reply_text(f"✅ Your voice notes will be transcribed with `{model_size}`.",
+                                    parse_mode="Markdown")
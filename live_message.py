@@ -0,0 +1,75 @@
+import asyncio
+import time
+from typing import Optional
+
+from telegram import Message
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+import config
+
+# Telegram's limit for the text of a single message
+MAX_MESSAGE_LENGTH = 4096
+
+
+class LiveMessage:
+    """
+    A single reply that is edited in place as its text grows.
+
+    The first update sends the message, later updates edit it. Edits closer together than
+    `min_interval` seconds are held back and only the newest text is sent, which keeps us
+    under Telegram's edit rate limits. finish() always flushes the last text.
+    """
+
+    def __init__(self, reply_to: Message, min_interval: float = None):
+        self.reply_to = reply_to
+        self.min_interval = config.LIVE_EDIT_INTERVAL if min_interval is None else min_interval
+
+        self._message: Optional[Message] = None
+        self._sent_text: Optional[str] = None
+        self._pending_text: Optional[str] = None
+        self._next_edit_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def update(self, text: str, force: bool = False):
+        self._pending_text = self._fit(text)
+
+        if not force and time.monotonic() < self._next_edit_at:
+            return
+
+        await self._flush()
+
+    async def finish(self, text: Optional[str] = None):
+        if text is not None:
+            self._pending_text = self._fit(text)
+
+        await self._flush()
+
+    async def _flush(self):
+        async with self._lock:
+            text = self._pending_text
+            if not text or text == self._sent_text:
+                return
+
+            try:
+                if self._message is None:
+                    self._message = await self.reply_to.reply_text(text)
+                else:
+                    await self._message.edit_text(text)
+                self._sent_text = text
+                self._next_edit_at = time.monotonic() + self.min_interval
+            except RetryAfter as e:
+                self._next_edit_at = time.monotonic() + float(e.retry_after)
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    print(f"[LiveMessage] Failed to update message: {e}")
+            except TelegramError as e:
+                print(f"[LiveMessage] Failed to update message: {e}")
+
+    @staticmethod
+    def _fit(text: str) -> str:
+        text = text.strip()
+        if len(text) <= MAX_MESSAGE_LENGTH:
+            return text
+
+        # Keep the newest part visible
+        return "…" + text[-(MAX_MESSAGE_LENGTH - 1):]
@@ -0,0 +1,174 @@
+import math
+import os
+import re
+import tempfile
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+import config
+from audio_preprocess import SAMPLE_RATE, decode, decoded_cache_path, duration, speech_timestamps
+
+# Whisper works in 30 second windows, smaller chunks only add overhead
+MIN_CHUNK_SECONDS = 30.0
+# Audio added either side of a cut that had to go through speech, so the words on the cut are heard whole
+OVERLAP_SECONDS = 2.0
+
+
+@dataclass
+class Chunk:
+    """
+    A piece of a long voice note that is transcribed on its own.
+
+    `spans` are (start, end) sample ranges of the decoded note, played end to end. A chunk cut in the middle
+    of speech carries OVERLAP_SECONDS of extra audio on each side, and only segments centred between
+    `keep_from` and `keep_to` (seconds into the chunk) are kept, so the overlap isn't transcribed twice.
+    """
+    spans: list[tuple[int, int]]
+    keep_from: float = 0.0
+    keep_to: float = math.inf
+
+
+def content_spans(speech: list[tuple[int, int]], total_samples: int, keep_silence: bool) -> list[tuple[int, int]]:
+    """
+    The parts of the note that get transcribed: the speech the VAD found, or with `keep_silence` the whole
+    note cut halfway through each pause.
+    """
+    if not keep_silence:
+        return list(speech)
+
+    spans = []
+    start = 0
+    for (_, previous_end), (next_start, _) in zip(speech, speech[1:]):
+        cut = (previous_end + next_start) // 2
+        spans.append((start, cut))
+        start = cut
+    spans.append((start, total_samples))
+    return spans
+
+
+def plan_chunks(spans: list[tuple[int, int]], total_samples: int, chunk_samples: int,
+                overlap_samples: int) -> list[Chunk]:
+    """
+    Packs consecutive spans into chunks of at most `chunk_samples`. A single span longer than that has
+    no pause to cut at, so it is cut every `chunk_samples` with `overlap_samples` of overlap.
+    """
+    chunks = []
+    current: list[tuple[int, int]] = []
+    current_samples = 0
+
+    for start, end in spans:
+        if current and current_samples + (end - start) > chunk_samples:
+            chunks.append(Chunk(spans=current))
+            current, current_samples = [], 0
+
+        if end - start <= chunk_samples:
+            current.append((start, end))
+            current_samples += end - start
+            continue
+
+        for piece_start in range(start, end, chunk_samples):
+            piece_end = min(piece_start + chunk_samples, end)
+            audio_start = max(0, piece_start - overlap_samples)
+            audio_end = min(total_samples, piece_end + overlap_samples)
+            chunks.append(Chunk(spans=[(audio_start, audio_end)],
+                                keep_from=(piece_start - audio_start) / SAMPLE_RATE,
+                                keep_to=(piece_end - audio_start) / SAMPLE_RATE))
+
+    if current:
+        chunks.append(Chunk(spans=current))
+
+    return chunks
+
+
+def parallelism() -> int:
+    """
+    How many chunks of one note can really be transcribed at once. Worker threads share one model,
+    which only runs WHISPER_NUM_WORKERS transcriptions at a time.
+    """
+    if config.TRANSCRIBE_EXECUTOR == "process":
+        return config.TRANSCRIBE_WORKERS
+    return min(config.TRANSCRIBE_WORKERS, config.WHISPER_NUM_WORKERS)
+
+
+def enabled() -> bool:
+    # Splitting a note that can't be transcribed in parallel only adds overhead and seams
+    return config.AUDIO_PREPROCESS and config.LONG_AUDIO_SECONDS > 0 and parallelism() > 1
+
+
+@dataclass
+class LongAudioPlan:
+    chunks: list[Chunk]
+    # The decoded note as .npy, which the chunk workers memory-map instead of decoding it again
+    pcm_path: str
+    # Whether pcm_path was written just for this plan and should be deleted afterwards
+    temporary: bool
+
+
+def plan(file_path: str) -> Optional[LongAudioPlan]:
+    """
+    Splits the voice note into chunks at its pauses, or returns None if it's shorter than LONG_AUDIO_SECONDS.
+    The note is decoded at most once, and not at all when its container says it's short.
+    """
+    seconds = duration(file_path)
+    if seconds is not None and seconds < config.LONG_AUDIO_SECONDS:
+        return None
+
+    audio = decode(file_path)
+    if len(audio) < config.LONG_AUDIO_SECONDS * SAMPLE_RATE:
+        return None
+
+    # The VAD finds the pauses to cut at even when VAD_ENABLED leaves the silence in
+    spans = content_spans(speech_timestamps(audio), len(audio), keep_silence=not config.VAD_ENABLED)
+    content_seconds = sum(end - start for start, end in spans) / SAMPLE_RATE
+
+    # Enough chunks to keep every worker busy, up to LONG_AUDIO_CHUNK_SECONDS each
+    chunk_seconds = max(MIN_CHUNK_SECONDS, min(config.LONG_AUDIO_CHUNK_SECONDS, content_seconds / parallelism()))
+
+    chunks = plan_chunks(spans, len(audio),
+                         chunk_samples=int(chunk_seconds * SAMPLE_RATE),
+                         overlap_samples=int(OVERLAP_SECONDS * SAMPLE_RATE))
+
+    # decode() has already saved a copy when AUDIO_CACHE_DECODED is on, otherwise write one for the workers
+    pcm_path = decoded_cache_path(file_path) if config.AUDIO_CACHE_DECODED else None
+    temporary = pcm_path is None or not os.path.exists(pcm_path)
+    if temporary:
+        fd, pcm_path = tempfile.mkstemp(prefix="long-audio-", suffix=".npy")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, audio)
+
+    print(f"[LongAudio] {os.path.basename(file_path)}: {len(audio) / SAMPLE_RATE:.1f}s of audio, "
+          f"{content_seconds:.1f}s to transcribe in {len(chunks)} chunks")
+    return LongAudioPlan(chunks=chunks, pcm_path=pcm_path, temporary=temporary)
+
+
+def chunk_audio(pcm_path: str, chunk: Chunk) -> np.ndarray:
+    # Memory-mapped, so each worker only reads its own chunk
+    audio = np.load(pcm_path, mmap_mode="r")
+    return np.concatenate([audio[start:end] for start, end in chunk.spans])
+
+
+def kept_text(chunk: Chunk, segments: list[tuple[float, float, str]]) -> list[str]:
+    """
+    The text of the (start, end, text) segments that belong to this chunk rather than its overlap.
+    """
+    return [text.strip() for start, end, text in segments
+            if chunk.keep_from <= (start + end) / 2 < chunk.keep_to and text.strip()]
+
+
+def _normalise(text: str) -> str:
+    return re.sub(r"[^\w\s]", "", text).lower().strip()
+
+
+def stitch(pieces: list[list[str]]) -> str:
+    """
+    Joins the chunks' segment texts in order. A segment repeated either side of a cut, which the overlap
+    can produce when Whisper's timestamps drift, is only kept once.
+    """
+    texts: list[str] = []
+    for piece in pieces:
+        if texts and piece and _normalise(texts[-1]) == _normalise(piece[0]):
+            piece = piece[1:]
+        texts.extend(piece)
+    return " ".join(texts)
@@ -0,0 +1,237 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from aiohttp import web
+
+import config
+
+# Seconds. Covers everything from a Telegram call to a large model on a long note.
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_registry: list["Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """
+    A named metric with optional labels, registered for the /metrics endpoint when created.
+    Label values are passed as keyword arguments, e.g. counter.inc(plugin="journiv").
+    """
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+        # Unlabelled counters and gauges start at 0 rather than being missing until first used
+        if not self.label_names and self.type in ("counter", "gauge"):
+            self._values[()] = 0
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"{self.name} takes labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        lines += self._samples()
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                for key, value in values.items()]
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. Pass `function` to read the value when scraped instead of setting it.
+    """
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), function: Optional[Callable[[], float]] = None):
+        super().__init__(name, help, labels)
+        self.function = function
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """
+        Counts the with block as in progress for as long as it runs.
+        """
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def _samples(self) -> list[str]:
+        if self.function is not None:
+            try:
+                return [f"{self.name} {_format_value(self.function())}"]
+            except Exception as e:
+                print(f"[Metrics] Failed to read {self.name}: {e}")
+                return []
+
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.label_names, key)} {_format_value(value)}"
+                for key, value in values.items()]
+
+
+class _Timer:
+    def __init__(self, histogram: "Histogram", labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        labels = dict(self.labels)
+        if "result" in self.histogram.label_names and "result" not in labels:
+            labels["result"] = "ok" if exc_type is None else "error"
+
+        self.histogram.observe(time.monotonic() - self.started, **labels)
+        return False
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+
+            series = self._values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def time(self, **labels) -> _Timer:
+        """
+        Times a with block. If the histogram has a "result" label and it isn't given,
+        it is filled in with "ok", or "error" when the block raises.
+        """
+        return _Timer(self, labels)
+
+    def _samples(self) -> list[str]:
+        with self._lock:
+            values = {key: {"buckets": list(s["buckets"]), "sum": s["sum"], "count": s["count"]}
+                      for key, s in self._values.items()}
+
+        lines = []
+        for key, series in values.items():
+            for bound, count in zip(self.buckets, series["buckets"]):
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, le)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {_format_value(series['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {series['count']}")
+        return lines
+
+
+def render() -> str:
+    """
+    All registered metrics in the Prometheus text format.
+    """
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+# Shared by handlers.py and processes.py, which each time their own stages of a voice note
+STAGE_SECONDS = Histogram("diary_stage_seconds",
+                          "Time spent in each stage of turning a voice note into a diary entry",
+                          labels=("stage", "result"))
+
+NOTES_IN_PROGRESS = Gauge("diary_notes_in_progress", "Voice notes currently being processed")
+
+_runner: Optional[web.AppRunner] = None
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+
+async def start_server(host: str = None, port: int = None):
+    """
+    Serves GET /metrics on host:port. Does nothing when the port is 0.
+    """
+    global _runner
+
+    host = host or config.METRICS_HOST
+    port = config.METRICS_PORT if port is None else port
+
+    if not port or _runner is not None:
+        return
+
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, host, port).start()
+    print(f"[Metrics] Serving metrics on http://{host}:{port}/metrics")
+
+
+async def stop_server():
+    global _runner
+
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -0,0 +1,296 @@
+import asyncio
+import json
+import random
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Awaitable, Callable, Optional
+
+from telegram import Bot
+
+import config
+import metrics
+from const import CONFIG_PATH
+
+OUTBOX_FILE = Path(CONFIG_PATH + "/outbox.db")
+
+OUTBOX_MAX_ATTEMPTS = max(1, config.get_int_env("OUTBOX_MAX_ATTEMPTS", 10))
+OUTBOX_BASE_DELAY = config.get_float_env("OUTBOX_BASE_DELAY", 30.0)
+OUTBOX_MAX_DELAY = config.get_float_env("OUTBOX_MAX_DELAY", 3600.0)
+OUTBOX_CONCURRENCY = max(1, config.get_int_env("OUTBOX_CONCURRENCY", 4))
+OUTBOX_POLL_INTERVAL = config.get_float_env("OUTBOX_POLL_INTERVAL", 15.0)
+
+
+@dataclass
+class OutboxItem:
+    id: int
+    plugin_id: str
+    user_id: int
+    idempotency_key: str
+    payload: dict
+    attempts: int = 0
+    last_error: Optional[str] = None
+
+
+class Outbox:
+    """
+    Plugin deliveries that must survive failures and restarts, kept in SQLite.
+
+    An item is added once per idempotency key and stays pending until it is marked done, or failed
+    after OUTBOX_MAX_ATTEMPTS. The payload is saved again before every retry, so a plugin can record
+    progress in it (e.g. the ID of an entry it already created) and skip that step next time.
+    """
+
+    _ITEM_COLUMNS = "id, plugin_id, user_id, idempotency_key, payload, attempts, last_error"
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                plugin_id TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                idempotency_key TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+        """)
+        self._conn.commit()
+
+    def add(self, plugin_id: str, user_id: int, idempotency_key: str, payload: dict) -> Optional[OutboxItem]:
+        """
+        Records a delivery. Returns None if one with the same idempotency key already exists.
+        """
+        now = time.time()
+
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO outbox (plugin_id, user_id, idempotency_key, payload, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (plugin_id, user_id, idempotency_key, json.dumps(payload), now, now)
+            )
+
+        if cursor.rowcount == 0:
+            return None
+
+        return OutboxItem(id=cursor.lastrowid, plugin_id=plugin_id, user_id=user_id,
+                          idempotency_key=idempotency_key, payload=payload)
+
+    def find(self, idempotency_key: str) -> Optional[tuple[OutboxItem, str]]:
+        """
+        Returns the delivery with this idempotency key and its status (pending, done or failed).
+        """
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {self._ITEM_COLUMNS}, status FROM outbox WHERE idempotency_key = ?", (idempotency_key,)
+            ).fetchone()
+
+        if row is None:
+            return None
+        return self._item(row), row[-1]
+
+    def due(self, limit: int) -> list[OutboxItem]:
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {self._ITEM_COLUMNS} FROM outbox "
+                "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY next_attempt_at LIMIT ?",
+                (time.time(), limit)
+            ).fetchall()
+
+        return [self._item(row) for row in rows]
+
+    @staticmethod
+    def _item(row) -> OutboxItem:
+        return OutboxItem(id=row[0], plugin_id=row[1], user_id=row[2], idempotency_key=row[3],
+                          payload=json.loads(row[4]), attempts=row[5], last_error=row[6])
+
+    def pending_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+
+    def save_progress(self, item: OutboxItem):
+        self._update(item, "payload = ?", (json.dumps(item.payload),))
+
+    def mark_done(self, item: OutboxItem):
+        self._update(item, "status = 'done', payload = ?", (json.dumps(item.payload),))
+
+    def mark_failed(self, item: OutboxItem):
+        self._update(item, "status = 'failed', payload = ?, attempts = ?, last_error = ?",
+                     (json.dumps(item.payload), item.attempts, item.last_error))
+
+    def reopen(self, item: OutboxItem):
+        """
+        Puts a failed delivery back to pending with a fresh set of attempts. Progress in its payload is kept.
+        """
+        item.attempts = 0
+        self._update(item, "status = 'pending', attempts = 0, next_attempt_at = ?", (time.time(),))
+
+    def reschedule(self, item: OutboxItem, delay: float):
+        self._update(item, "payload = ?, attempts = ?, last_error = ?, next_attempt_at = ?",
+                     (json.dumps(item.payload), item.attempts, item.last_error, time.time() + delay))
+
+    def _update(self, item: OutboxItem, assignments: str, params: tuple):
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE outbox SET {assignments} WHERE id = ?", (*params, item.id))
+
+
+class OutboxWorker:
+    """
+    Drains the outbox in the background, running at most OUTBOX_CONCURRENCY deliveries at once
+    and backing off exponentially (with jitter) between attempts of the same item.
+    """
+
+    def __init__(self, store: Outbox, deliver: Callable[[Bot, OutboxItem], Awaitable]):
+        self.store = store
+        self.deliver = deliver
+        self.bot: Optional[Bot] = None
+
+        self._semaphore = asyncio.Semaphore(OUTBOX_CONCURRENCY)
+        self._wakeup = asyncio.Event()
+        self._in_progress: set[int] = set()
+        # The event loop only keeps weak references to tasks, hold on to attempts until they finish
+        self._attempt_tasks: set[asyncio.Task] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, bot: Bot):
+        self.bot = bot
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        # Interrupted attempts are still pending in the store and go out on the next start
+        for task in list(self._attempt_tasks):
+            task.cancel()
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def attempt(self, item: OutboxItem) -> bool:
+        """
+        Tries to deliver the item now. Returns whether it was delivered, failures are left for retry.
+        """
+        if item.id in self._in_progress:
+            return False
+
+        self._in_progress.add(item.id)
+        try:
+            async with self._semaphore:
+                return await self._attempt(item)
+        finally:
+            self._in_progress.discard(item.id)
+
+    async def _attempt(self, item: OutboxItem) -> bool:
+        try:
+            await self.deliver(self.bot, item)
+        except Exception as e:
+            item.attempts += 1
+            item.last_error = f"{type(e).__name__}: {e}"
+
+            if item.attempts >= OUTBOX_MAX_ATTEMPTS:
+                print(f"[Outbox] Giving up on {item.plugin_id} delivery {item.id}: {item.last_error}")
+                self.store.mark_failed(item)
+                await self._notify_failed(item)
+            else:
+                delay = min(OUTBOX_MAX_DELAY, OUTBOX_BASE_DELAY * (2 ** (item.attempts - 1)))
+                delay *= random.uniform(0.5, 1.0)
+                print(f"[Outbox] {item.plugin_id} delivery {item.id} failed, retrying in {delay:.0f}s: {item.last_error}")
+                self.store.reschedule(item, delay)
+
+            return False
+
+        self.store.mark_done(item)
+        return True
+
+    async def _notify_failed(self, item: OutboxItem):
+        try:
+            await self.bot.send_message(chat_id=item.user_id,
+                                        text=f"❌ Gave up delivering your entry to {item.plugin_id} after "
+                                             f"{item.attempts} attempts:\n{item.last_error}")
+        except Exception as e:
+            print(f"[Outbox] Failed to notify {item.user_id}: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                for item in self.store.due(limit=OUTBOX_CONCURRENCY * 4):
+                    if item.id not in self._in_progress:
+                        task = asyncio.create_task(self.attempt(item))
+                        self._attempt_tasks.add(task)
+                        task.add_done_callback(self._attempt_done)
+            except Exception as e:
+                print(f"[Outbox] Failed to read outbox: {e}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def _attempt_done(self, task: asyncio.Task):
+        self._attempt_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[Outbox] Delivery attempt failed unexpectedly: {task.exception()}")
+
+
+store = Outbox(OUTBOX_FILE)
+worker: Optional[OutboxWorker] = None
+
+metrics.Gauge("diary_outbox_pending", "Plugin deliveries waiting to be sent or retried",
+              function=lambda: store.pending_count())
+
+
+def start_worker(bot: Bot, deliver: Callable[[Bot, OutboxItem], Awaitable]):
+    global worker
+
+    worker = OutboxWorker(store, deliver)
+    worker.start(bot)
+
+    pending = store.pending_count()
+    if pending:
+        print(f"[Outbox] {pending} deliveries waiting to be retried")
+
+
+async def stop_worker():
+    if worker is not None:
+        await worker.stop()
+
+
+async def enqueue(plugin_id: str, user_id: int, idempotency_key: str, payload: dict) -> bool:
+    """
+    Records a delivery and makes a first attempt straight away.
+    Returns whether it has been delivered. Failed attempts are retried by the worker.
+
+    Enqueuing a delivery that's already recorded (a manual retry) attempts it again now, unless it was
+    delivered. One that had given up starts over with a fresh set of attempts.
+    """
+    item = store.add(plugin_id, user_id, idempotency_key, payload)
+
+    if item is None:
+        item, status = store.find(idempotency_key)
+
+        if status == "done":
+            print(f"[Outbox] Delivery {idempotency_key} already delivered, skipping")
+            return True
+
+        if status == "failed":
+            print(f"[Outbox] Retrying delivery {idempotency_key} that had given up")
+            store.reopen(item)
+
+    if worker is None:
+        return False
+
+    return await worker.attempt(item)
@@ -1,8 +1,9 @@
 import datetime
+from typing import Optional
 
 
-def get_filenames_format() -> str:
-    now = datetime.datetime.now()
+def get_filenames_format(now: Optional[datetime.datetime] = None) -> str:
+    now = now or datetime.datetime.now()
     timestamp = int(now.timestamp())
     formatted_date = now.strftime("%d_%m_%Y_%H_%M")
 
@@ -13,5 +14,5 @@ def get_audio_filename() -> str:
     return get_filenames_format() + ".ogg"
 
 
-def get_transcription_filename() -> str:
-    return get_filenames_format() + ".txt"
+def get_transcription_filename(now: Optional[datetime.datetime] = None) -> str:
+    return get_filenames_format(now) + ".txt"
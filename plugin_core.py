@@ -1,16 +1,33 @@
+import copy
+import asyncio
 import inspect
 import json
-from pathlib import Path
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Optional
 
-from telegram import Message, BotCommand
+from telegram import Message, BotCommand, Bot
 from telegram.ext import Application
 
 import importlib
 import os
 import pkgutil
 
+import config
+import metrics
+import outbox
+import storage
+from outbox import OutboxItem
+
 
 class BasePlugin:
+    # IDs of plugins whose on_entry has to finish before this plugin's on_entry starts
+    depends_on: list[str] = []
+
+    # Seconds on_entry may run before it is cancelled. None uses PLUGIN_TIMEOUT.
+    timeout: Optional[float] = None
+
     def get_id(self) -> str:
         raise NotImplementedError
 
@@ -31,15 +48,44 @@ class BasePlugin:
     def load_config(self, user_id: int) -> dict:
         return get_user_config(user_id, self.get_id())
 
+    def update_config(self, user_id: int, change: Callable[[Any], Any]):
+        return config_store.update(user_id, self.get_id(), change)
+
     def load_commands(self) -> list[BotCommand]:
         return []
 
+    async def deliver(self, bot: Bot, item: OutboxItem):
+        """
+        Delivers an item queued with queue_delivery(). Raise to have it retried later with backoff.
+        Progress stored in item.payload is kept between attempts.
+        """
+        raise NotImplementedError
+
+    async def queue_delivery(self, user_id: int, idempotency_key: str, payload: dict) -> bool:
+        """
+        Records a delivery in the durable outbox and attempts it straight away.
+        Returns whether that first attempt succeeded.
+        """
+        return await outbox.enqueue(self.get_id(), user_id, idempotency_key, payload)
+
+    async def shutdown(self):
+        """
+        Called when the application stops. Close sessions, flush buffers, etc.
+        """
+        pass
+
 
 PLUGIN_ENV = os.getenv("ENABLED_PLUGINS", "")  # e.g. "pluginone,plugintwo"
 ENABLED_PLUGIN_IDS = {p.strip() for p in PLUGIN_ENV.split(",") if p.strip()}
+PLUGIN_TIMEOUT = config.get_float_env("PLUGIN_TIMEOUT", 60.0)
 
 plugins = []
 
+PLUGIN_SECONDS = metrics.Histogram("diary_plugin_seconds", "Time each plugin's on_entry takes",
+                                   labels=("plugin", "result"))
+DELIVERY_SECONDS = metrics.Histogram("diary_plugin_delivery_seconds", "Time each outbox delivery attempt takes",
+                                     labels=("plugin", "result"))
+
 
 def get_loaded_plugin_commands() -> list[BotCommand]:
     commands = []
@@ -50,7 +96,11 @@ def get_loaded_plugin_commands() -> list[BotCommand]:
 
     return commands
 
-def load_plugins(application: Application):
+def load_plugins(application: Optional[Application]):
+    """
+    Loads the enabled plugins. Pass application=None when running headless,
+    the plugins are then not asked to register their Telegram handlers.
+    """
     global plugins
     plugins = []
 
@@ -68,51 +118,201 @@ def load_plugins(application: Application):
 
                 if plugin_id in ENABLED_PLUGIN_IDS:
                     print(f"[PluginCore] Enabled plugin: {plugin_id}")
-                    plugin_instance.load(application)
+                    if application is not None:
+                        plugin_instance.load(application)
                     plugins.append(plugin_instance)
                 else:
                     print(f"[PluginCore] Disabled plugin: {plugin_id}")
 
+    plugins = order_plugins(plugins)
+
+
+def get_plugin(plugin_id: str) -> Optional[BasePlugin]:
+    for plugin in plugins:
+        if plugin.get_id() == plugin_id:
+            return plugin
+    return None
+
+
+async def deliver(bot: Bot, item: OutboxItem):
+    plugin = get_plugin(item.plugin_id)
+    if plugin is None:
+        raise RuntimeError(f"Plugin {item.plugin_id} is not enabled")
+
+    timeout = plugin.timeout if plugin.timeout is not None else PLUGIN_TIMEOUT
+    with DELIVERY_SECONDS.time(plugin=item.plugin_id):
+        await asyncio.wait_for(plugin.deliver(bot, item), timeout=timeout)
+
+
+async def shutdown_plugins():
+    for plugin in plugins:
+        try:
+            await plugin.shutdown()
+        except Exception as e:
+            print(f"[PluginCore] Plugin {plugin.get_id()} failed to shut down: {e}")
+
+
+def order_plugins(unordered: list[BasePlugin]) -> list[BasePlugin]:
+    """
+    Sorts plugins so each comes after the plugins it depends on.
+    Dependencies on plugins that aren't loaded are ignored, and a cycle is broken in load order.
+    """
+    by_id = {plugin.get_id(): plugin for plugin in unordered}
+    ordered = []
+    placed = set()
+    remaining = list(unordered)
+
+    while remaining:
+        ready = [p for p in remaining if all(d in placed or d not in by_id for d in p.depends_on)]
+
+        if not ready:
+            print(f"[PluginCore] Dependency cycle between {[p.get_id() for p in remaining]}, using load order")
+            ready = [remaining[0]]
+
+        for plugin in ready:
+            ordered.append(plugin)
+            placed.add(plugin.get_id())
+            remaining.remove(plugin)
+
+    return ordered
+
 
 async def run_plugins(source_message, transcription_path, voice_note_path, diary_entry):
+    """
+    Runs every plugin's on_entry at the same time, apart from waiting on declared dependencies.
+    Each plugin has its own timeout and a failure in one doesn't affect the others.
+    """
     global plugins
 
+    tasks: dict[str, asyncio.Task] = {}
+
+    async def run(plugin: BasePlugin, dependencies: list[asyncio.Task]):
+        if dependencies:
+            await asyncio.wait(dependencies)
+
+        plugin_id = plugin.get_id()
+        timeout = plugin.timeout if plugin.timeout is not None else PLUGIN_TIMEOUT
+
+        started = time.monotonic()
+        result = "ok"
+        try:
+            print(f"[PluginCore] Running plugin {plugin_id}")
+            await asyncio.wait_for(plugin.on_entry(source_message, transcription_path, voice_note_path, diary_entry),
+                                   timeout=timeout)
+        except asyncio.TimeoutError:
+            result = "timeout"
+            print(f"[PluginCore] Plugin {plugin_id} timed out after {timeout}s")
+        except Exception as e:
+            result = "error"
+            print(f"[PluginCore] Plugin {plugin_id} failed: {e}")
+        finally:
+            PLUGIN_SECONDS.observe(time.monotonic() - started, plugin=plugin_id, result=result)
+
+    # plugins is already in dependency order, so every dependency has its task by the time it's needed
     for plugin in plugins:
+        dependencies = [tasks[d] for d in plugin.depends_on if d in tasks]
+        tasks[plugin.get_id()] = asyncio.create_task(run(plugin, dependencies))
+
+    if tasks:
+        await asyncio.gather(*tasks.values())
+
+
+class PluginConfigStore:
+    """
+    Caches each user's plugin sections in memory on top of the storage backend.
+
+    update() is a read-modify-write that saves once. Inside a batch() block saves are held
+    back and each changed section is written once when the block exits.
+    """
+
+    def __init__(self):
+        self._cache: dict[tuple[str, str], Any] = {}
+        self._pending: set[tuple[str, str]] = set()
+        self._batch_depth = 0
+        self._lock = threading.RLock()
+
+        self.reads = 0
+        self.writes = 0
+        self.cache_hits = 0
+
+    def get(self, user_id, plugin_id: str):
+        key = (str(user_id), plugin_id)
+
+        with self._lock:
+            if key in self._cache:
+                self.cache_hits += 1
+            else:
+                self.reads += 1
+                self._cache[key] = storage.get_backend().get_plugin_config(*key)
+
+            # Callers get their own copy so changes only land through set()/update()
+            return copy.deepcopy(self._cache[key])
+
+    def set(self, user_id, plugin_id: str, data):
+        # Verify parcelable
         try:
-            print(f"[PluginCore] Running plugin {plugin.get_id()}")
-            await plugin.on_entry(source_message, transcription_path, voice_note_path, diary_entry)
+            json.dumps(data)
         except Exception as e:
-            print(f"[PluginCore] Plugin {plugin.get_id()} failed: {e}")
+            raise ValueError(f"Plugin data must be JSON-serializable: {e}")
 
+        key = (str(user_id), plugin_id)
 
-from const import CONFIG_PATH
-CONFIG_FILE = Path(CONFIG_PATH + "/plugin_config.json")
+        with self._lock:
+            self._cache[key] = copy.deepcopy(data)
+            self._pending.add(key)
 
+            if self._batch_depth == 0:
+                self._write_pending()
 
-def load_all_configs():
-    if CONFIG_FILE.exists():
-        return json.loads(CONFIG_FILE.read_text())
-    return {}
+    def update(self, user_id, plugin_id: str, change: Callable[[Any], Any]):
+        """
+        Applies change to the current section and saves the result once.
+        change may return the new data, or mutate what it's given and return None.
+        """
+        with self._lock:
+            current = self.get(user_id, plugin_id)
+            updated = change(current)
+            if updated is None:
+                updated = current
 
+            self.set(user_id, plugin_id, updated)
+            return copy.deepcopy(updated)
 
-def save_all_configs(cfg):
-    CONFIG_FILE.write_text(json.dumps(cfg, indent=2))
+    @contextmanager
+    def batch(self):
+        with self._lock:
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+                if self._batch_depth == 0:
+                    self._write_pending()
 
+    def stats(self) -> dict:
+        return {
+            "reads": self.reads,
+            "writes": self.writes,
+            "cache_hits": self.cache_hits,
+            "cached_sections": len(self._cache),
+        }
 
-def save_user_config(user_id: str, plugin_id: str, data):
-    # Verify parcelable
-    try:
-        json.dumps(data)
-    except Exception as e:
-        raise ValueError(f"Plugin data must be JSON-serializable: {e}")
+    def _write_pending(self):
+        backend = storage.get_backend()
 
-    cfg = load_all_configs()
-    cfg.setdefault(str(user_id), {})
-    cfg[str(user_id)][plugin_id] = data
-    save_all_configs(cfg)
+        for key in self._pending:
+            backend.save_plugin_config(key[0], key[1], self._cache[key])
+            self.writes += 1
 
+        self._pending.clear()
 
-def get_user_config(user_id: str, plugin_id: str):
-    cfg = load_all_configs()
-    return cfg.get(str(user_id), {}).get(plugin_id)
 
+config_store = PluginConfigStore()
+
+
+def save_user_config(user_id: str, plugin_id: str, data):
+    config_store.set(user_id, plugin_id, data)
+
+
+def get_user_config(user_id: str, plugin_id: str):
+    return config_store.get(user_id, plugin_id)
@@ -1,11 +1,18 @@
+import asyncio
+import hashlib
+import os
 from dataclasses import dataclass, asdict, fields
+from datetime import datetime
 from typing import Optional, Dict, Any
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Message, BotCommand
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, Message, BotCommand, Bot
 from telegram.ext import Application, CommandHandler, ContextTypes, CallbackQueryHandler
 
+import outbox
+from file_index import extract_timestamp
+from outbox import OutboxItem
 from plugin_core import BasePlugin
-from plugins.journiv_api import load_journals, journiv_login, upload_journiv_entry, journiv_refresh, upload_media
+from plugins.journiv_api import get_client, close_clients, prepare_media, JournivClient
 
 
 @dataclass
@@ -68,6 +75,9 @@ class JournivPlugin(BasePlugin):
     def get_id(self):
         return "journiv"
 
+    async def shutdown(self):
+        await close_clients()
+
     async def on_entry(self, source_message: Message, transcription_path, voice_note_path, diary_entry: str):
         stored_data = self.load_config(source_message.chat.id)
 
@@ -77,41 +87,106 @@ class JournivPlugin(BasePlugin):
 
         await source_message.reply_text("Processing with Journiv plugin…")
 
+        # One entry per transcription. The diary text comes from the LLM and differs every run, so it can't
+        # be part of the key: a retry has to find the delivery it's retrying and reopen its stored payload
+        idempotency_key = hashlib.sha256(
+            f"{source_message.chat.id}:{transcription_path}".encode("utf-8")
+        ).hexdigest()
+
+        delivered = await self.queue_delivery(source_message.chat.id, idempotency_key, {
+            "diary_entry": diary_entry,
+            "voice_note_path": voice_note_path,
+            "entry_datetime": self.entry_datetime(voice_note_path).isoformat(),
+        })
+
+        if not delivered:
+            await source_message.reply_text("Upload to Journiv failed, it will be retried automatically.")
+
+    @staticmethod
+    def entry_datetime(voice_note_path: Optional[str]) -> datetime:
+        # When the voice note was received, so backfilled and retried entries land on the right day
+        received = extract_timestamp(os.path.basename(voice_note_path)) if voice_note_path else 0
+        if received:
+            return datetime.fromtimestamp(received).astimezone()
+        return datetime.now().astimezone()
+
+    async def deliver(self, bot: Bot, item: OutboxItem):
+        payload = item.payload
+        stored_data = self.load_config(item.user_id)
+        client = get_client(stored_data.base_url)
+
+        # Get the voice note ready (compressing it if it's large) while the entry uploads
+        media = None
+        if payload.get("voice_note_path") and not payload.get("media_uploaded"):
+            media = asyncio.create_task(prepare_media(payload["voice_note_path"]))
+
         try:
-            access_token = await journiv_login(stored_data.base_url, stored_data.email, stored_data.password)
+            await self._upload(client, stored_data, item, media)
+        finally:
+            if media is not None:
+                await self._discard_media(media)
 
-            uploaded_entry = await upload_journiv_entry(
-                base_url=stored_data.base_url,
-                access_token=access_token,
-                journal_id=stored_data.journal_id,
-                content=diary_entry
-            )
+        entry_url = f"{stored_data.base_url}/#/entries/{payload['entry_id']}/edit?journalId={payload['journal_id']}"
+        keyboard = [
+            [InlineKeyboardButton("Open Entry ↗️", url=entry_url)]
+        ]
+        markup = InlineKeyboardMarkup(keyboard)
 
-            entry_id = uploaded_entry["id"]
-            journal_id = uploaded_entry["journal_id"]
+        await bot.send_message(
+            chat_id=item.user_id,
+            text="✨ *Entry created!* Tap below to view or edit it:",
+            reply_markup=markup,
+            parse_mode="Markdown",
+        )
 
-            # Upload voice note
-            await upload_media(
-                base_url=stored_data.base_url,
-                access_token=access_token,
-                file_path=voice_note_path,
-                entry_id=entry_id
+    async def _upload(self, client: JournivClient, stored_data: JournivConfig, item: OutboxItem,
+                      media: Optional[asyncio.Task]):
+        payload = item.payload
+
+        if not payload.get("entry_id"):
+            uploaded_entry = await client.authorized(
+                stored_data.email,
+                stored_data.password,
+                lambda access_token: client.upload_entry(
+                    access_token=access_token,
+                    journal_id=stored_data.journal_id,
+                    content=payload["diary_entry"],
+                    entry_datetime=datetime.fromisoformat(payload["entry_datetime"])
+                )
             )
 
-            entry_url = f"{stored_data.base_url}/#/entries/{entry_id}/edit?journalId={journal_id}"
-            keyboard = [
-                [InlineKeyboardButton("Open Entry ↗️", url=entry_url)]
-            ]
-            markup = InlineKeyboardMarkup(keyboard)
-
-            await source_message.reply_text(
-                text="✨ *Entry created!* Tap below to view or edit it:",
-                reply_markup=markup,
-                parse_mode="Markdown",
+            # Remember the entry straight away so a retry never creates it twice
+            payload["entry_id"] = uploaded_entry["id"]
+            payload["journal_id"] = uploaded_entry["journal_id"]
+            outbox.store.save_progress(item)
+
+        # Upload voice note
+        if media is not None:
+            media_path, _ = await media
+
+            await client.authorized(
+                stored_data.email,
+                stored_data.password,
+                lambda access_token: client.upload_media(
+                    access_token=access_token,
+                    file_path=media_path,
+                    entry_id=payload["entry_id"]
+                )
             )
+            payload["media_uploaded"] = True
 
-        except Exception as e:
-            await source_message.reply_text(f"Upload failed:\n{e}")
+    @staticmethod
+    async def _discard_media(media: asyncio.Task):
+        if not media.done():
+            media.cancel()
+            return
+
+        if media.cancelled() or media.exception() is not None:
+            return
+
+        media_path, is_temporary = media.result()
+        if is_temporary:
+            await asyncio.to_thread(os.remove, media_path)
 
     """
     Setup Functions
@@ -132,7 +207,7 @@ class JournivPlugin(BasePlugin):
 
         # Validate API
         try:
-            access_token = await journiv_login(base_url, email, password)
+            access_token = await get_client(base_url).login(email, password)
         except Exception as e:
             return await update.message.reply_text(str(e))
 
@@ -143,24 +218,25 @@ class JournivPlugin(BasePlugin):
             journal_id=""
         )
 
-        self.save_config(
-            update.effective_user.id,
-            config.to_dict()
-        )
-
         try:
-            journals = await load_journals(config.base_url, access_token)
+            journals = await get_client(config.base_url).load_journals(access_token)
         except Exception as e:
+            # Keep the working credentials so only the journal needs choosing later
+            self.save_config(
+                update.effective_user.id,
+                config.to_dict()
+            )
             return await update.message.reply_text(str(e))
 
         if len(journals) == 1:
             config.journal_id = journals[0]["id"]
 
-            self.save_config(
-                update.effective_user.id,
-                config.to_dict()
-            )
+        self.save_config(
+            update.effective_user.id,
+            config.to_dict()
+        )
 
+        if len(journals) == 1:
             return await update.message.reply_text(
                 f"Setup complete. Logging to: {journals[0]['title']}"
             )
@@ -185,18 +261,11 @@ class JournivPlugin(BasePlugin):
 
         journal_id, journal_name = query.data[len("journiv_select_"):].split("_")
 
-        stored_data = self.load_config(update.effective_user.id)
+        def set_journal(data: dict) -> dict:
+            data = self.migrate_journiv_config(data)
+            data["journal_id"] = journal_id
+            return data
 
-        new_config = JournivConfig(
-            base_url=stored_data.base_url,
-            email=stored_data.email,
-            password=stored_data.password,
-            journal_id=journal_id
-        )
-
-        self.save_config(
-            update.effective_user.id,
-            new_config.to_dict()
-        )
+        self.update_config(update.effective_user.id, set_journal)
 
         await query.edit_message_text(f"Journiv setup complete for journal {journal_name}!")
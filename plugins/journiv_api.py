@@ -1,12 +1,109 @@
+import asyncio
+import base64
 import json
+import mimetypes
+import os
+import shutil
+import tempfile
+import time
+from dataclasses import dataclass
 
 import aiohttp
 from datetime import datetime, timezone
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Callable, Awaitable, TypeVar
 
+import config
+import metrics
 
-def format_title_for_today() -> str:
-    now = datetime.now()
+T = TypeVar("T")
+
+JOURNIV_TIMEOUT = config.get_float_env("JOURNIV_TIMEOUT", 30.0)
+JOURNIV_CONNECTION_LIMIT = config.get_int_env("JOURNIV_CONNECTION_LIMIT", 10)
+JOURNIV_KEEPALIVE = config.get_float_env("JOURNIV_KEEPALIVE", 30.0)
+
+# Voice notes bigger than this are compressed with ffmpeg before upload. 0 disables it.
+JOURNIV_TRANSCODE_OVER_BYTES = config.get_int_env("JOURNIV_TRANSCODE_OVER_BYTES", 0)
+JOURNIV_TRANSCODE_BITRATE = os.getenv("JOURNIV_TRANSCODE_BITRATE", "24k")
+
+UPLOAD_CHUNK_SIZE = 256 * 1024
+
+# Refresh access tokens this many seconds before they expire
+TOKEN_REFRESH_MARGIN = 60
+# Lifetime assumed for access tokens that don't say when they expire
+DEFAULT_TOKEN_LIFETIME = 15 * 60
+
+
+REQUEST_SECONDS = metrics.Histogram("journiv_request_seconds",
+                                    "Time from sending a request to Journiv until its response headers arrive",
+                                    labels=("endpoint", "status"))
+
+
+async def _on_request_start(session, context, params):
+    context.started = time.monotonic()
+
+
+async def _on_request_end(session, context, params):
+    REQUEST_SECONDS.observe(time.monotonic() - context.started,
+                            endpoint=params.url.path, status=params.response.status)
+
+
+async def _on_request_exception(session, context, params):
+    REQUEST_SECONDS.observe(time.monotonic() - context.started, endpoint=params.url.path, status="error")
+
+
+def _trace_config() -> aiohttp.TraceConfig:
+    """
+    Times every request made through a client's session.
+    """
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(_on_request_start)
+    trace_config.on_request_end.append(_on_request_end)
+    trace_config.on_request_exception.append(_on_request_exception)
+    return trace_config
+
+
+class JournivUnauthorizedError(RuntimeError):
+    """
+    Raised when Journiv rejects an access token with a 401.
+    """
+    pass
+
+
+@dataclass
+class JournivTokens:
+    access_token: str
+    refresh_token: str
+    expires_at: float
+
+    @classmethod
+    def from_response(cls, data: dict, previous_refresh_token: Optional[str] = None) -> "JournivTokens":
+        access_token = data["access_token"]
+        return cls(
+            access_token=access_token,
+            # Journiv may rotate the refresh token, otherwise keep using the old one
+            refresh_token=data.get("refresh_token") or previous_refresh_token,
+            expires_at=_token_expiry(access_token, data),
+        )
+
+    def is_fresh(self) -> bool:
+        return time.time() < self.expires_at - TOKEN_REFRESH_MARGIN
+
+
+def _token_expiry(access_token: str, data: dict) -> float:
+    if "expires_in" in data:
+        return time.time() + float(data["expires_in"])
+
+    # Access tokens are JWTs, read the exp claim without verifying the signature
+    try:
+        payload = access_token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except Exception:
+        return time.time() + DEFAULT_TOKEN_LIFETIME
+
+
+def format_title_for_today(now: Optional[datetime] = None) -> str:
+    now = now or datetime.now()
 
     day = now.day
     suffix = "th"
@@ -20,47 +117,82 @@ def format_title_for_today() -> str:
     return now.strftime(f"%A {day}{suffix} %B")
 
 
-async def upload_journiv_entry(
-        base_url: str,
-        access_token: str,
-        journal_id: str,
-        content: str,
-        title: Optional[str] = None,
-        prompt_id: Optional[str] = None,
-        location: Optional[str] = None,
-        weather: Optional[str] = None,
-) -> dict:
+class JournivClient:
     """
-    Upload a journaling entry to Journiv.
+    Talks to one Journiv server over a single pooled aiohttp session.
+
+    The session is created on first use and kept open, so consecutive requests reuse the same
+    keep-alive connections instead of paying for a new TCP/TLS handshake each time.
+    Use get_client() rather than creating these directly.
     """
 
-    if title is None:
-        title = format_title_for_today()
-
-    now = datetime.now()
-    now_utc = datetime.now(timezone.utc)
-
-    payload = {
-        "title": title,
-        "content": content,
-        "entry_date": now.strftime("%Y-%m-%d"),
-        "entry_datetime_utc": now_utc.isoformat(),
-        "entry_timezone": str(now.astimezone().tzinfo),
-        "location": location or "",
-        "weather": weather or "",
-        "journal_id": journal_id,
-        "prompt_id": prompt_id,
-    }
-
-    url = f"{base_url.rstrip('/')}/api/v1/entries/"
-
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
-
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, json=payload, headers=headers) as resp:
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip('/')
+        self._session: Optional[aiohttp.ClientSession] = None
+
+        # Tokens per account email, with a lock each so concurrent entries share one refresh
+        self._tokens: Dict[str, JournivTokens] = {}
+        self._token_locks: Dict[str, asyncio.Lock] = {}
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=JOURNIV_CONNECTION_LIMIT, keepalive_timeout=JOURNIV_KEEPALIVE)
+            # No total timeout so large uploads aren't cut off, only stalled connections and reads
+            timeout = aiohttp.ClientTimeout(connect=JOURNIV_TIMEOUT, sock_read=JOURNIV_TIMEOUT)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                                  trace_configs=[_trace_config()])
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def upload_entry(
+            self,
+            access_token: str,
+            journal_id: str,
+            content: str,
+            title: Optional[str] = None,
+            prompt_id: Optional[str] = None,
+            location: Optional[str] = None,
+            weather: Optional[str] = None,
+            entry_datetime: Optional[datetime] = None,
+    ) -> dict:
+        """
+        Upload a journaling entry to Journiv.
+        entry_datetime defaults to now, pass the original time when uploading an entry late.
+        """
+
+        now = entry_datetime or datetime.now().astimezone()
+        now_utc = now.astimezone(timezone.utc)
+
+        if title is None:
+            title = format_title_for_today(now)
+
+        payload = {
+            "title": title,
+            "content": content,
+            "entry_date": now.strftime("%Y-%m-%d"),
+            "entry_datetime_utc": now_utc.isoformat(),
+            "entry_timezone": str(now.astimezone().tzinfo),
+            "location": location or "",
+            "weather": weather or "",
+            "journal_id": journal_id,
+            "prompt_id": prompt_id,
+        }
+
+        url = f"{self.base_url}/api/v1/entries/"
+
+        headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json"
+        }
+
+        async with self.session.post(url, json=payload, headers=headers) as resp:
+            if resp.status == 401:
+                raise JournivUnauthorizedError("Invalid or expired access token.")
             if resp.status >= 400:
                 text = await resp.text()
                 raise RuntimeError(
@@ -68,34 +200,31 @@ async def upload_journiv_entry(
                 )
             return await resp.json()
 
+    async def load_journals(self, access_token: str) -> List[Dict]:
+        """
+        Fetch the list of journals for the current user from Journiv.
 
-async def load_journals(base_url: str, access_token: str) -> List[Dict]:
-    """
-    Fetch the list of journals for the current user from Journiv.
+        Args:
+            access_token (str): Access token to use to load journals
 
-    Args:
-        base_url (str): Base URL of the server
-        access_token (str): Access token to use to load journals
+        Returns:
+            List[Dict]: List of journal objects, e.g. [{"id": "123", "name": "Work"}, ...]
 
-    Returns:
-        List[Dict]: List of journal objects, e.g. [{"id": "123", "name": "Work"}, ...]
+        Raises:
+            RuntimeError: If the request fails or returns unexpected data
+        """
 
-    Raises:
-        RuntimeError: If the request fails or returns unexpected data
-    """
+        url = f"{self.base_url}/api/v1/journals/?include_archived=false"
 
-    url = f"{base_url.rstrip('/')}/api/v1/journals/?include_archived=false"
-
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Accept": "application/json"
-    }
+        headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Accept": "application/json"
+        }
 
-    async with aiohttp.ClientSession() as session:
         try:
-            async with session.get(url, headers=headers) as resp:
+            async with self.session.get(url, headers=headers) as resp:
                 if resp.status == 401:
-                    raise ValueError("Invalid or expired access token.")
+                    raise JournivUnauthorizedError("Invalid or expired access token.")
                 if resp.status >= 400:
                     text = await resp.text()
                     raise RuntimeError(f"Failed to fetch journals: {resp.status}, {text}")
@@ -105,36 +234,34 @@ async def load_journals(base_url: str, access_token: str) -> List[Dict]:
         except aiohttp.ClientError as e:
             raise RuntimeError(f"Network error contacting Journiv: {e}")
 
-    # Ensure data is a list
-    if not isinstance(data, list):
-        raise RuntimeError(f"Unexpected response from Journiv API: {data}")
+        # Ensure data is a list
+        if not isinstance(data, list):
+            raise RuntimeError(f"Unexpected response from Journiv API: {data}")
 
-    return data
+        return data
 
+    async def refresh(self, refresh_token: str):
+        """
+        Refresh the access token using the given refresh token.
 
-async def journiv_refresh(base_url: str, refresh_token: str):
-    """
-    Refresh the access token using the given refresh token.
+        Returns:
+            {
+                "access_token": "...",
+                "refresh_token": "..."
+            }
+        """
+        url = f"{self.base_url}/api/v1/auth/refresh"
 
-    Returns:
-        {
-            "access_token": "...",
-            "refresh_token": "..."
+        payload = {
+            "refresh_token": refresh_token
         }
-    """
-    url = f"{base_url.rstrip('/')}/api/v1/auth/refresh"
-
-    payload = {
-        "refresh_token": refresh_token
-    }
 
-    headers = {
-        "Accept": "application/json",
-        "Content-Type": "application/json"
-    }
+        headers = {
+            "Accept": "application/json",
+            "Content-Type": "application/json"
+        }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(url, json=payload, headers=headers) as resp:
+        async with self.session.post(url, json=payload, headers=headers) as resp:
             # Unauthorized / invalid refresh token
             if resp.status == 401:
                 raise ValueError("Refresh token is invalid or expired.")
@@ -145,29 +272,27 @@ async def journiv_refresh(base_url: str, refresh_token: str):
 
             data = await resp.json()
 
-    if "access_token" not in data:
-        raise RuntimeError(f"Unexpected refresh token response: {data}")
-
-    return data
+        if "access_token" not in data:
+            raise RuntimeError(f"Unexpected refresh token response: {data}")
 
+        return data
 
-async def journiv_login(base_url: str, email: str, password: str) -> str:
-    """
-    Attempt to log into Journiv and return access token.
+    async def login(self, email: str, password: str) -> str:
+        """
+        Attempt to log into Journiv and return access token.
 
-    Raises ValueError on invalid credentials.
-    Raises RuntimeError on unexpected server errors.
-    """
+        Raises ValueError on invalid credentials.
+        Raises RuntimeError on unexpected server errors.
+        """
 
-    url = f"{base_url.rstrip('/')}/api/v1/auth/login"
-    payload = {
-        "email": email,
-        "password": password
-    }
+        url = f"{self.base_url}/api/v1/auth/login"
+        payload = {
+            "email": email,
+            "password": password
+        }
 
-    async with aiohttp.ClientSession() as session:
         try:
-            async with session.post(url, json=payload) as resp:
+            async with self.session.post(url, json=payload) as resp:
                 # If journiv returns 401 / 403 on invalid login:
                 if resp.status in (401, 403):
                     raise ValueError("Invalid email or password.")
@@ -186,48 +311,179 @@ async def journiv_login(base_url: str, email: str, password: str) -> str:
         except aiohttp.ClientError as e:
             raise RuntimeError(f"Network error contacting Journiv: {e}")
 
-    # Validate JSON structure
-    if "access_token" not in data or "refresh_token" not in data:
-        raise RuntimeError("Journiv login succeeded but tokens are missing.")
+        # Validate JSON structure
+        if "access_token" not in data or "refresh_token" not in data:
+            raise RuntimeError("Journiv login succeeded but tokens are missing.")
+
+        self._tokens[email] = JournivTokens.from_response(data)
+
+        return data["access_token"]
+
+    async def get_access_token(self, email: str, password: str, force_refresh: bool = False) -> str:
+        """
+        Returns a usable access token for the account.
+
+        Cached tokens are used until shortly before they expire, then refreshed with the refresh token.
+        Only falls back to logging in with the password when there are no tokens or the refresh fails.
+        """
+        lock = self._token_locks.setdefault(email, asyncio.Lock())
+
+        async with lock:
+            tokens = self._tokens.get(email)
+
+            if tokens is not None and not force_refresh and tokens.is_fresh():
+                return tokens.access_token
 
-    return data["access_token"]
+            if tokens is not None and tokens.refresh_token:
+                try:
+                    data = await self.refresh(tokens.refresh_token)
+                    self._tokens[email] = JournivTokens.from_response(data, tokens.refresh_token)
+                    return self._tokens[email].access_token
+                except (ValueError, RuntimeError, aiohttp.ClientError) as e:
+                    print(f"[Journiv] Token refresh failed, logging in again: {e}")
+                    self._tokens.pop(email, None)
 
+            return await self.login(email, password)
 
-async def upload_media(
-    base_url: str,
-    access_token: str,
-    file_path: str,
-    entry_id: Optional[str] = None,
-    alt_text: Optional[str] = None
-) -> dict:
+    async def authorized(self, email: str, password: str, call: Callable[[str], Awaitable[T]]) -> T:
+        """
+        Runs call with a cached access token. If Journiv rejects it, the token is refreshed and call is run once more.
+        """
+        access_token = await self.get_access_token(email, password)
+
+        try:
+            return await call(access_token)
+        except JournivUnauthorizedError:
+            access_token = await self.get_access_token(email, password, force_refresh=True)
+            return await call(access_token)
+
+    async def upload_media(
+        self,
+        access_token: str,
+        file_path: str,
+        entry_id: Optional[str] = None,
+        alt_text: Optional[str] = None
+    ) -> dict:
+        """
+        Asynchronously upload a media file to Journiv using aiohttp.
+        """
+
+        url = f"{self.base_url}/api/v1/media/upload"
+
+        headers = {
+            "Authorization": f"Bearer {access_token}"
+        }
+
+        data = {}
+        if entry_id is not None:
+            data["entry_id"] = entry_id
+        if alt_text is not None:
+            data["alt_text"] = alt_text
+
+        if not file_path or not os.path.exists(file_path):
+            raise FileNotFoundError(f"Media file not found: {file_path}")
+
+        form = aiohttp.FormData()
+        form.add_field(
+            name="file",
+            value=_read_chunks(file_path),
+            filename=os.path.basename(file_path),
+            content_type=media_content_type(file_path)
+        )
+        for k, v in data.items():
+            form.add_field(k, v)
+
+        async with self.session.post(url, headers=headers, data=form) as resp:
+            if resp.status == 401:
+                raise JournivUnauthorizedError("Invalid or expired access token.")
+            resp.raise_for_status()
+            return await resp.json()
+
+
+async def _read_chunks(file_path: str):
     """
-    Asynchronously upload a media file to Journiv using aiohttp.
+    Reads the file on a worker thread a chunk at a time, so uploads stream without blocking the event loop.
     """
+    f = await asyncio.to_thread(open, file_path, "rb")
+    try:
+        while True:
+            chunk = await asyncio.to_thread(f.read, UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        await asyncio.to_thread(f.close)
+
+
+def media_content_type(file_path: str) -> str:
+    content_type, _ = mimetypes.guess_type(file_path)
+    if content_type:
+        return content_type
+
+    # Telegram voice notes are Opus in an Ogg container
+    if file_path.lower().endswith((".ogg", ".oga", ".opus")):
+        return "audio/ogg"
+
+    return "application/octet-stream"
+
+
+async def prepare_media(file_path: str) -> tuple[str, bool]:
+    """
+    Returns the path to upload and whether it's a temporary file the caller should delete.
+
+    Audio larger than JOURNIV_TRANSCODE_OVER_BYTES is re-encoded to low bitrate mono Opus first
+    when ffmpeg is available. Anything else is uploaded as it is.
+    """
+    if not JOURNIV_TRANSCODE_OVER_BYTES or not file_path:
+        return file_path, False
+
+    size = await asyncio.to_thread(os.path.getsize, file_path)
+    if size <= JOURNIV_TRANSCODE_OVER_BYTES:
+        return file_path, False
+
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is None:
+        print("[Journiv] ffmpeg not found, uploading voice note without compressing it")
+        return file_path, False
+
+    fd, output_path = tempfile.mkstemp(suffix=".ogg")
+    os.close(fd)
+
+    process = await asyncio.create_subprocess_exec(
+        ffmpeg, "-y", "-loglevel", "error", "-i", file_path,
+        "-ac", "1", "-c:a", "libopus", "-b:a", JOURNIV_TRANSCODE_BITRATE, output_path,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        _, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        process.kill()
+        os.remove(output_path)
+        raise
+
+    if process.returncode != 0:
+        print(f"[Journiv] Failed to compress voice note, uploading original: {stderr.decode(errors='ignore')}")
+        os.remove(output_path)
+        return file_path, False
+
+    return output_path, True
+
+
+_clients: Dict[str, JournivClient] = {}
+
+
+def get_client(base_url: str) -> JournivClient:
+    """
+    Returns the shared client for a Journiv server, one per base URL.
+    """
+    key = base_url.rstrip('/')
+    if key not in _clients:
+        _clients[key] = JournivClient(key)
+    return _clients[key]
+
 
-    url = f"{base_url.rstrip('/')}/api/v1/media/upload"
-
-    headers = {
-        "Authorization": f"Bearer {access_token}"
-    }
-
-    data = {}
-    if entry_id is not None:
-        data["entry_id"] = entry_id
-    if alt_text is not None:
-        data["alt_text"] = alt_text
-
-    async with aiohttp.ClientSession() as session:
-        with open(file_path, "rb") as f:
-            form = aiohttp.FormData()
-            form.add_field(
-                name="file",
-                value=f,
-                filename=file_path.split("/")[-1],
-                content_type="application/octet-stream"
-            )
-            for k, v in data.items():
-                form.add_field(k, v)
-
-            async with session.post(url, headers=headers, data=form) as resp:
-                resp.raise_for_status()
-                return await resp.json()
\ No newline at end of file
+async def close_clients():
+    for client in list(_clients.values()):
+        await client.close()
+    _clients.clear()
@@ -1,54 +1,191 @@
+import asyncio
+import datetime
 import os
 from typing import Optional
 
-from telegram import Message
-
+import config
+import metrics
 import plugin_core
 import user_config
 from const import TRANSCRIPTION_DIR
 from diary_writer import generate_diary_entry
+from file_index import record_file
 from paths import get_transcription_filename
-from transcribe import transcribe_voice
+from reporting import Reporter
+from transcribe import transcribe_voice_async, transcribe_voice_streaming
+from transcription_cache import cache, hash_bytes, hash_file
+from transcription_queue import get_queue, QueueFullError
+
+
+async def audio_file_to_diary(reporter: Reporter, filepath: str,
+                              stylise: Optional[bool] = None, run_plugins: bool = True,
+                              data: Optional[bytes] = None) -> Optional[str]:
+    """
+    Transcribes the voice note at filepath and turns it into a diary entry, which is returned.
+    Returns None when the note was skipped (already in progress, turned away by the queue or no speech),
+    the reporter has been told why.
+
+    `data` is the voice note when it was downloaded into memory instead. Transcription starts from it
+    straight away while it is written to filepath in the background, and plugins run once it's on disk.
+    """
+    archive = asyncio.create_task(asyncio.to_thread(write_audio, filepath, data)) if data is not None else None
+    try:
+        return await _audio_to_diary(reporter, filepath, stylise, run_plugins, data, archive)
+    finally:
+        # The note must end up in AUDIO_DIR whatever happened to it, /processaudio relies on that
+        if archive is not None:
+            await archive
+
+
+async def _audio_to_diary(reporter: Reporter, filepath: str, stylise: Optional[bool], run_plugins: bool,
+                          data: Optional[bytes], archive: Optional[asyncio.Task]) -> Optional[str]:
+    with metrics.NOTES_IN_PROGRESS.track():
+        user_id = reporter.user_id
+        model_size = user_config.load_user_config(user_id).whisper_model
+
+        with metrics.STAGE_SECONDS.time(stage="hash"):
+            if data is not None:
+                audio_hash = hash_bytes(data)
+            else:
+                audio_hash = await asyncio.to_thread(hash_file, filepath)
+        cache_key = cache.make_key(user_id, audio_hash, model_size)
+
+        if cache_key in cache.in_flight:
+            await reporter.notify("♻️ This voice note is already being transcribed.")
+            return
+
+        transcription_path = cache.get(cache_key)
+
+        if transcription_path:
+            await reporter.notify("♻️ This voice note was already transcribed, reusing it.")
+        else:
+            cache.in_flight.add(cache_key)
+            try:
+                with metrics.STAGE_SECONDS.time(stage="transcribe"):
+                    transcription_path = await transcribe_to_file(reporter, filepath, model_size, data)
+            finally:
+                cache.in_flight.discard(cache_key)
+
+            if transcription_path is None:
+                return
+
+            cache.put(cache_key, transcription_path)
+
+        # Send the transcription text file
+        with metrics.STAGE_SECONDS.time(stage="send_transcription"):
+            await reporter.send_file(transcription_path, caption="📝 Here's your transcription")
+
+        if archive is not None:
+            await archive
 
+        return await transcribed_file_to_diary(reporter, audio_path=filepath, transcription_path=transcription_path,
+                                               stylise=stylise, run_plugins=run_plugins)
 
-async def audio_file_to_diary(telegram_message: Message, filepath: str) -> str:
-    await telegram_message.reply_text("Transcribing...")
-    text = transcribe_voice(filepath)
 
-    user_id = telegram_message.chat.id
+def write_audio(path: str, data: bytes):
+    with metrics.STAGE_SECONDS.time(stage="archive"):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+    record_file(path)
 
-    transcription_filename = get_transcription_filename()
-    transcription_path = os.path.join(TRANSCRIPTION_DIR, str(user_id), transcription_filename)
 
-    os.makedirs(os.path.dirname(transcription_path), exist_ok=True)
+async def transcribe_to_file(reporter: Reporter, filepath: str, model_size: Optional[str],
+                             data: Optional[bytes] = None) -> Optional[str]:
+    """
+    Queues the audio for transcription and writes the result under TRANSCRIPTION_DIR.
+    Returns the transcription path, or None if the queue turned the job away or there was no speech.
+    """
+    user_id = reporter.user_id
+    status = reporter.live_status()
+
+    async def transcribe():
+        if config.TRANSCRIBE_STREAMING:
+            return await transcribe_voice_streaming(filepath,
+                                                    on_text=lambda partial: status.update(f"📝 {partial}"),
+                                                    model_size=model_size, data=data)
+        return await transcribe_voice_async(filepath, model_size, data)
+
+    try:
+        job, position = get_queue().submit(user_id, transcribe)
+    except QueueFullError:
+        await reporter.notify("🚦 Lots of people are sending notes right now. Your voice note is saved, "
+                              "use /processaudio to transcribe it in a few minutes.")
+        return None
+
+    if position:
+        await status.update(f"⏳ You're #{position} in the queue. Transcription will start shortly.", force=True)
+    else:
+        await status.update("Transcribing...", force=True)
+
+    text = await job
+
+    if not text.strip():
+        await status.finish("🤷 I couldn't hear any speech in that voice note.")
+        return None
+
+    if config.TRANSCRIBE_STREAMING:
+        await status.finish(f"📝 {text}")
+
+    return write_transcription(user_id, text)
+
+
+def write_transcription(user_id: int, text: str) -> str:
+    user_directory = os.path.join(TRANSCRIPTION_DIR, str(user_id))
+    os.makedirs(user_directory, exist_ok=True)
+
+    # Names only go down to the second, so step forward if several land at once
+    now = datetime.datetime.now()
+    while True:
+        transcription_path = os.path.join(user_directory, get_transcription_filename(now))
+        try:
+            f = open(transcription_path, "x", encoding="utf-8")
+            break
+        except FileExistsError:
+            now += datetime.timedelta(seconds=1)
 
     # Save transcription to file
-    with open(transcription_path, "w", encoding="utf-8") as f:
+    with f:
         f.write(text)
+    record_file(transcription_path)
 
-    # Send the transcription text file
-    await telegram_message.reply_document(document=open(transcription_path, "rb"),
-                                          filename=transcription_filename,
-                                          caption="📝 Here's your transcription")
+    return transcription_path
 
-    await transcribed_file_to_diary(telegram_message, audio_path=filepath, transcription_path=transcription_path)
 
-
-async def transcribed_file_to_diary(telegram_message: Message, audio_path: Optional[str],
-                                    transcription_path: str) -> str:
+async def transcribed_file_to_diary(reporter: Reporter, audio_path: Optional[str], transcription_path: str,
+                                    stylise: Optional[bool] = None, run_plugins: bool = True) -> str:
+    """
+    Stylises the transcription (if the user has AI enabled, or stylise says so) and hands the result to plugins.
+    """
     with open(transcription_path, "r", encoding="utf-8") as f:
         transcribed_text = f.read()
-    user_id = telegram_message.chat.id
+    user_id = reporter.user_id
 
-    config = user_config.load_user_config(user_id)
+    if stylise is None:
+        stylise = user_config.load_user_config(user_id).ai_enabled
 
-    if config.ai_enabled:
-        await telegram_message.reply_text("Using AI to stylise diary entry...")
-        diary = generate_diary_entry(transcribed_text, user_id)
+    if stylise:
+        with metrics.STAGE_SECONDS.time(stage="stylise"):
+            if config.AI_STREAMING:
+                status = reporter.live_status()
+                await status.update("Using AI to stylise diary entry...", force=True)
+                diary = await generate_diary_entry(transcribed_text, user_id,
+                                                   on_text=lambda partial: status.update(f"✍️ {partial}"))
+                # The entry itself is delivered by plugins, so don't leave a second copy in the chat
+                await status.finish("✍️ Diary entry written.")
+            else:
+                await reporter.notify("Using AI to stylise diary entry...")
+                diary = await generate_diary_entry(transcribed_text, user_id)
     else:
         diary = transcribed_text
 
-    await plugin_core.run_plugins(source_message=telegram_message,
-                                  voice_note_path=audio_path,
-                                  transcription_path=transcription_path,
-                                  diary_entry=diary)
+    if not run_plugins:
+        return diary
+
+    with metrics.STAGE_SECONDS.time(stage="plugins"):
+        await plugin_core.run_plugins(source_message=reporter.source_message,
+                                      voice_note_path=audio_path,
+                                      transcription_path=transcription_path,
+                                      diary_entry=diary)
+
+    return diary
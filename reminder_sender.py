@@ -0,0 +1,153 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from telegram.error import Forbidden, RetryAfter, TelegramError
+
+import config
+import metrics
+
+REMINDER_LAG_SECONDS = metrics.Histogram("diary_reminder_lag_seconds",
+                                         "Time from a reminder coming due to it reaching Telegram",
+                                         buckets=(1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0))
+REMINDERS = metrics.Counter("diary_reminders_total", "Reminders by outcome", labels=("result",))
+
+
+class TokenBucket:
+    """
+    Allows `rate` operations per second on average, with bursts of up to `capacity`.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        # The lock hands tokens out in arrival order, so no one waits forever behind a stream of newcomers
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+@dataclass
+class PendingReminder:
+    user_id: int
+    due_at: float  # unix time the reminder was due
+    attempts: int = 0
+
+
+class ReminderSender:
+    """
+    Sends reminders from a queue without tripping Telegram's flood limits.
+
+    A global token bucket keeps the bot under REMINDER_RATE messages a second, and messages to the same
+    chat are kept REMINDER_CHAT_INTERVAL apart. A RetryAfter from Telegram pauses every worker for as long
+    as it asks and the reminder goes back on the queue. Users who blocked the bot are not retried.
+    """
+
+    def __init__(self, send: Callable[[int], Awaitable], rate: float, chat_interval: float, workers: int):
+        self.send = send
+        self.chat_interval = chat_interval
+        self.worker_count = workers
+
+        self._bucket = TokenBucket(rate=rate, capacity=max(1.0, rate))
+        self._queue: asyncio.Queue[PendingReminder] = asyncio.Queue()
+        self._last_sent: dict[int, float] = {}
+        self._paused_until = 0.0
+        self._workers: list[asyncio.Task] = []
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+    def enqueue(self, user_id: int, due_at: float):
+        self._queue.put_nowait(PendingReminder(user_id=user_id, due_at=due_at))
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    async def _wait_for_chat(self, user_id: int):
+        last_sent = self._last_sent.get(user_id)
+        if last_sent is not None:
+            wait = last_sent + self.chat_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+    async def _worker(self):
+        while True:
+            reminder = await self._queue.get()
+            try:
+                await self._deliver(reminder)
+            except Exception as e:
+                print(f"[Reminders] Unexpected error sending to {reminder.user_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, reminder: PendingReminder):
+        await self._wait_for_chat(reminder.user_id)
+        await self._bucket.acquire()
+
+        # Checked last, a pause can start while we wait for a token
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            await asyncio.sleep(pause)
+
+        self._last_sent[reminder.user_id] = time.monotonic()
+
+        try:
+            await self.send(reminder.user_id)
+        except RetryAfter as e:
+            print(f"[Reminders] Flood limit hit, pausing sends for {e.retry_after}s")
+            self._paused_until = max(self._paused_until, time.monotonic() + float(e.retry_after))
+            # Not the reminder's fault, so it doesn't count as an attempt
+            REMINDERS.inc(result="retried_flood")
+            self._queue.put_nowait(reminder)
+            return
+        except Forbidden:
+            # Blocked the bot or deleted their account, nothing to retry
+            REMINDERS.inc(result="blocked")
+            return
+        except TelegramError as e:
+            print(f"[Reminders] Failed to send reminder to {reminder.user_id}: {e}")
+            self._retry(reminder)
+            return
+        finally:
+            self._forget_idle_chats()
+
+        REMINDERS.inc(result="sent")
+        REMINDER_LAG_SECONDS.observe(max(0.0, time.time() - reminder.due_at))
+
+    def _retry(self, reminder: PendingReminder):
+        reminder.attempts += 1
+        if reminder.attempts >= config.REMINDER_MAX_ATTEMPTS:
+            print(f"[Reminders] Giving up on reminder for {reminder.user_id} after {reminder.attempts} attempts")
+            REMINDERS.inc(result="failed")
+            return
+
+        REMINDERS.inc(result="retried_error")
+        self._queue.put_nowait(reminder)
+
+    def _forget_idle_chats(self, limit: int = 10_000):
+        # Per-chat spacing only matters for a moment, don't let the map grow with every user
+        if len(self._last_sent) < limit:
+            return
+
+        cutoff = time.monotonic() - self.chat_interval
+        self._last_sent = {user_id: sent for user_id, sent in self._last_sent.items() if sent > cutoff}
+
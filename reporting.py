@@ -0,0 +1,95 @@
+import os
+from types import SimpleNamespace
+
+from telegram import Message
+
+from live_message import LiveMessage
+
+
+class Reporter:
+    """
+    Where the pipeline in processes.py sends its progress and results.
+
+    source_message is handed to plugins. It is a Telegram Message, or for headless runs an
+    object with the same chat.id and reply_text() that plugins use.
+    """
+    user_id: int
+    source_message = None
+
+    async def notify(self, text: str):
+        raise NotImplementedError
+
+    async def send_file(self, path: str, caption: str):
+        raise NotImplementedError
+
+    def live_status(self):
+        """
+        Returns something with async update(text, force=False) and finish(text=None), like LiveMessage.
+        """
+        raise NotImplementedError
+
+
+class TelegramReporter(Reporter):
+    def __init__(self, message: Message):
+        self.message = message
+        self.user_id = message.chat.id
+        self.source_message = message
+
+    async def notify(self, text: str):
+        await self.message.reply_text(text)
+
+    async def send_file(self, path: str, caption: str):
+        with open(path, "rb") as f:
+            await self.message.reply_document(document=f, filename=os.path.basename(path), caption=caption)
+
+    def live_status(self) -> LiveMessage:
+        return LiveMessage(self.message)
+
+
+class ConsoleStatus:
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self._text = None
+
+    async def update(self, text: str, force: bool = False):
+        self._text = text
+        if force:
+            print(f"{self.prefix} {text}")
+
+    async def finish(self, text: str = None):
+        text = text or self._text
+        if text:
+            print(f"{self.prefix} {text}")
+
+
+class ConsoleMessage:
+    """
+    Stands in for a Telegram Message when plugins run headless. Replies are printed.
+    """
+
+    def __init__(self, user_id: int, prefix: str):
+        self.chat = SimpleNamespace(id=user_id)
+        self.prefix = prefix
+
+    async def reply_text(self, text: str, **kwargs):
+        print(f"{self.prefix} {text}")
+
+
+class ConsoleReporter(Reporter):
+    """
+    Reports to stdout, for running the pipeline without Telegram.
+    """
+
+    def __init__(self, user_id: int, label: str = ""):
+        self.user_id = user_id
+        self.prefix = f"[{label or user_id}]"
+        self.source_message = ConsoleMessage(user_id, self.prefix)
+
+    async def notify(self, text: str):
+        print(f"{self.prefix} {text}")
+
+    async def send_file(self, path: str, caption: str):
+        print(f"{self.prefix} {caption}: {path}")
+
+    def live_status(self) -> ConsoleStatus:
+        return ConsoleStatus(self.prefix)
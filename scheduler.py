@@ -1,28 +1,42 @@
 import json
+import os
+import time
+from collections import defaultdict
+from datetime import datetime, timezone, tzinfo
 from pathlib import Path
-from typing import Dict
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
-from telegram import Bot
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from telegram import Bot
+from tzlocal import get_localzone
 
+import config
+import metrics
 import user_config
 from const import CONFIG_PATH
+from reminder_sender import ReminderSender
 from user_config import UserConfig
 
 config_file = Path(CONFIG_PATH + "/config.json")
+REMINDER_STATE_FILE = Path(CONFIG_PATH + "/reminder_state.json")
 
 
-def migrate_reminders():
+def migrate_reminders() -> list[int]:
+    """
+    Moves reminders from the old config.json into user config. Returns the migrated user IDs.
+    """
     if not config_file.exists():
-        return
+        return []
 
     try:
         with config_file.open("r") as f:
             raw = json.load(f)
     except json.JSONDecodeError:
         print("Config file corrupted or invalid JSON — skipping migration.")
-        return
+        return []
 
+    migrated = []
     for user_id_str, reminder_time in raw.items():
         try:
             user_id = int(user_id_str)
@@ -36,6 +50,7 @@ def migrate_reminders():
             reminder_time=reminder_time
         )
         user_config.save_user_config(user_id, new_config)
+        migrated.append(user_id)
 
     # Delete the old file
     try:
@@ -45,43 +60,197 @@ def migrate_reminders():
         print(f"Failed to delete old reminder file: {e}")
 
     print("Reminders migrated successfully.")
+    return migrated
+
+
+def system_timezone() -> tzinfo:
+    # A named zone rather than today's UTC offset, so reminders follow daylight saving changes
+    return get_localzone()
+
+
+def parse_timezone(name: str) -> Optional[tzinfo]:
+    """
+    Returns the IANA time zone with this name (e.g. Europe/London), or None if there isn't one.
+    """
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+class ReminderIndex:
+    """
+    Which users want a reminder at each local time, keyed by (time zone name, "HH:MM").
+    A zone name of None is the bot's local time.
+
+    Finding who is due in a minute is one lookup per time zone in use, however many users there are.
+    """
+
+    def __init__(self):
+        self._users: dict[tuple[Optional[str], str], set[int]] = defaultdict(set)
+        self._keys: dict[int, tuple[Optional[str], str]] = {}
+        self._zones: dict[Optional[str], tzinfo] = {None: system_timezone()}
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def set(self, user_id: int, cfg: UserConfig):
+        self.remove(user_id)
+
+        if not cfg.reminder_time:
+            return
+
+        try:
+            hour, minute = map(int, cfg.reminder_time.split(":"))
+        except ValueError:
+            print(f"[Reminders] Invalid reminder time {cfg.reminder_time} for {user_id}")
+            return
+
+        zone_name = cfg.timezone
+        if zone_name and zone_name not in self._zones:
+            zone = parse_timezone(zone_name)
+            if zone is None:
+                print(f"[Reminders] Unknown time zone {zone_name} for {user_id}, using the bot's")
+                zone_name = None
+            else:
+                self._zones[zone_name] = zone
+
+        key = (zone_name, f"{hour:02d}:{minute:02d}")
+        self._users[key].add(user_id)
+        self._keys[user_id] = key
+
+    def remove(self, user_id: int):
+        key = self._keys.pop(user_id, None)
+        if key is None:
+            return
+
+        users = self._users[key]
+        users.discard(user_id)
+        if not users:
+            del self._users[key]
+
+    def due(self, moment: datetime) -> list[int]:
+        """
+        Users whose reminder falls in the minute starting at `moment` (a timezone-aware datetime).
+        """
+        due = []
+        for zone_name, zone in self._zones.items():
+            due.extend(self._users.get((zone_name, moment.astimezone(zone).strftime("%H:%M")), ()))
+        return due
+
 
+_scheduler: Optional[AsyncIOScheduler] = None
+_bot: Optional[Bot] = None
+_sender: Optional[ReminderSender] = None
+index = ReminderIndex()
+
+metrics.Gauge("diary_reminder_users", "Users with a daily reminder", function=lambda: len(index))
+metrics.Gauge("diary_reminder_queue_depth", "Reminders waiting to be sent",
+              function=lambda: _sender.pending() if _sender else 0)
+
+
+def _load_last_tick() -> Optional[int]:
+    try:
+        return json.loads(REMINDER_STATE_FILE.read_text())["last_tick"]
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return None
+
+
+def _save_last_tick(minute: int):
+    tmp_file = REMINDER_STATE_FILE.with_suffix(".tmp")
+    tmp_file.write_text(json.dumps({"last_tick": minute}))
+    os.replace(tmp_file, REMINDER_STATE_FILE)
+
+
+async def _tick():
+    """
+    Runs at the start of every minute and queues the reminders due in it.
+
+    Minutes missed since the last tick (the bot was down, or the tick ran late) are caught up,
+    up to REMINDER_CATCH_UP_MINUTES back. A minute is never dispatched twice.
+    """
+    minute = int(time.time() // 60)
+    last_tick = _load_last_tick()
+
+    first = minute if last_tick is None else max(last_tick + 1, minute - config.REMINDER_CATCH_UP_MINUTES)
+
+    queued = 0
+    for m in range(first, minute + 1):
+        for user_id in index.due(datetime.fromtimestamp(m * 60, timezone.utc)):
+            _sender.enqueue(user_id, due_at=m * 60)
+            queued += 1
+
+    if first <= minute:
+        _save_last_tick(minute)
+
+    if queued:
+        print(f"[Reminders] Sending {queued} reminders")
+
+
+def start(bot: Bot):
+    """
+    Builds the reminder index and starts the per-minute tick. Must be called with the event loop running.
+    """
+    global _scheduler, _bot, _sender
+
+    _bot = bot
 
-def load_reminders() -> dict[int, UserConfig]:
-    ## To migrate from old storage to new user config
     migrate_reminders()
+    for user_id, cfg in user_config.load_all_configs().items():
+        index.set(user_id, cfg)
+    print(f"[Reminders] {len(index)} users have a daily reminder")
+
+    _sender = ReminderSender(send_reminder,
+                             rate=config.REMINDER_RATE,
+                             chat_interval=config.REMINDER_CHAT_INTERVAL,
+                             workers=config.REMINDER_SEND_WORKERS)
+    _sender.start()
+
+    _scheduler = AsyncIOScheduler(timezone=timezone.utc)
+    _scheduler.add_job(_tick, trigger="cron", second=0, id="reminder_tick",
+                       coalesce=True, max_instances=1, misfire_grace_time=55)
+    _scheduler.start()
+
+
+async def shutdown():
+    global _scheduler
+
+    if _scheduler is not None:
+        _scheduler.shutdown(wait=False)
+        _scheduler = None
+
+    if _sender is not None:
+        await _sender.stop()
+
 
-    return user_config.load_all_configs()
+def reschedule(user_id: int):
+    """
+    Brings this user's place in the index in line with their config, leaving everyone else's alone.
+    """
+    index.set(user_id, user_config.load_user_config(user_id))
 
 
-def save_reminder(user_id: int, time_str: str):
-    reminders = load_reminders()
-    reminders[user_id].reminder_time = time_str
+def save_reminder(user_id: int, time_str: Optional[str]):
+    """
+    Sets the user's daily reminder time (HH:MM), or removes it with None.
+    """
+    def change(cfg: UserConfig):
+        cfg.reminder_time = time_str
 
-    user_config.save_user_config(user_id, reminders[user_id])
+    user_config.update_user_config(user_id, change)
+    reschedule(user_id)
 
 
-def schedule_reminders(scheduler: AsyncIOScheduler, bot: Bot):
-    reminders = load_reminders()
-    for user_id, user_config in reminders.items():
-        if user_config.reminder_time:
-            hour, minute = map(int, user_config.reminder_time.split(":"))
+def save_timezone(user_id: int, timezone_name: Optional[str]):
+    def change(cfg: UserConfig):
+        cfg.timezone = timezone_name
 
-            scheduler.add_job(
-                send_reminder,
-                trigger='cron',
-                hour=hour,
-                minute=minute,
-                args=[bot, int(user_id)],
-                id=f"reminder_{user_id}",
-                replace_existing=True,
-            )
-        else:
-            print(f"No reminder time for {user_id}")
+    user_config.update_user_config(user_id, change)
+    reschedule(user_id)
 
 
-async def send_reminder(bot: Bot, user_id: int):
-    await bot.send_message(
+async def send_reminder(user_id: int):
+    await _bot.send_message(
         chat_id=user_id,
         text="📝 Time to record your daily diary entry! Send me a voice note when you're ready."
     )
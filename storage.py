@@ -0,0 +1,256 @@
+import json
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+import config
+from const import CONFIG_PATH, STYLE_DIR
+
+USER_CONFIG_FILE = Path(CONFIG_PATH + "/user_config.json")
+PLUGIN_CONFIG_FILE = Path(CONFIG_PATH + "/plugin_config.json")
+DATABASE_FILE = Path(CONFIG_PATH + "/storage.db")
+
+
+class StorageBackend:
+    """
+    Where user configs, plugin configs and styles are kept.
+    User configs and plugin data are plain JSON-serialisable dicts at this level.
+    """
+
+    def load_all_user_configs(self) -> dict[int, dict]:
+        raise NotImplementedError
+
+    def save_user_configs(self, configs: dict[int, dict]):
+        """
+        Insert or replace the given users' configs. Users not in `configs` are left alone.
+        """
+        raise NotImplementedError
+
+    def get_plugin_config(self, user_id, plugin_id: str) -> Optional[Any]:
+        raise NotImplementedError
+
+    def save_plugin_config(self, user_id, plugin_id: str, data: Any):
+        raise NotImplementedError
+
+    def get_style(self, user_id: int) -> Optional[str]:
+        raise NotImplementedError
+
+    def save_style(self, user_id: int, style: str):
+        raise NotImplementedError
+
+
+def _write_atomic(path: Path, text: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = path.with_suffix(".tmp")
+    tmp_file.write_text(text)
+    os.replace(tmp_file, path)
+
+
+def _read_json(path: Path) -> dict:
+    if not path.exists():
+        return {}
+
+    try:
+        return json.loads(path.read_text())
+    except json.JSONDecodeError:
+        print(f"[Storage] {path.name} is corrupted or invalid JSON, ignoring it")
+        return {}
+
+
+class JsonStorage(StorageBackend):
+    """
+    The original layout: user_config.json, plugin_config.json and one text file per style.
+    Every write rewrites the whole file.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def load_all_user_configs(self) -> dict[int, dict]:
+        return {int(user_id): data for user_id, data in _read_json(USER_CONFIG_FILE).items()}
+
+    def save_user_configs(self, configs: dict[int, dict]):
+        with self._lock:
+            raw = _read_json(USER_CONFIG_FILE)
+            for user_id, data in configs.items():
+                raw[str(user_id)] = data
+            _write_atomic(USER_CONFIG_FILE, json.dumps(raw, indent=2))
+
+    def load_all_plugin_configs(self) -> dict[str, dict]:
+        return _read_json(PLUGIN_CONFIG_FILE)
+
+    def get_plugin_config(self, user_id, plugin_id: str) -> Optional[Any]:
+        return self.load_all_plugin_configs().get(str(user_id), {}).get(plugin_id)
+
+    def save_plugin_config(self, user_id, plugin_id: str, data: Any):
+        with self._lock:
+            raw = self.load_all_plugin_configs()
+            raw.setdefault(str(user_id), {})[plugin_id] = data
+            _write_atomic(PLUGIN_CONFIG_FILE, json.dumps(raw, indent=2))
+
+    @staticmethod
+    def _style_path(user_id: int) -> str:
+        return os.path.join(STYLE_DIR, f"user_{user_id}_style.txt")
+
+    def load_all_styles(self) -> dict[int, str]:
+        styles = {}
+
+        if not os.path.isdir(STYLE_DIR):
+            return styles
+
+        for filename in os.listdir(STYLE_DIR):
+            if not (filename.startswith("user_") and filename.endswith("_style.txt")):
+                continue
+            try:
+                user_id = int(filename[len("user_"):-len("_style.txt")])
+            except ValueError:
+                continue
+
+            with open(os.path.join(STYLE_DIR, filename), "r", encoding="utf-8") as f:
+                styles[user_id] = f.read()
+
+        return styles
+
+    def get_style(self, user_id: int) -> Optional[str]:
+        path = self._style_path(user_id)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+        return None
+
+    def save_style(self, user_id: int, style: str):
+        os.makedirs(STYLE_DIR, exist_ok=True)
+        with open(self._style_path(user_id), "w", encoding="utf-8") as f:
+            f.write(style)
+
+
+class SqliteStorage(StorageBackend):
+    """
+    One WAL-mode SQLite database with a row per user (and per user + plugin), keyed by primary key.
+    A single connection is shared between threads behind a lock.
+    """
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS user_config (
+                user_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS plugin_config (
+                user_id TEXT NOT NULL,
+                plugin_id TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (user_id, plugin_id)
+            );
+            CREATE TABLE IF NOT EXISTS user_style (
+                user_id INTEGER PRIMARY KEY,
+                style TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        self._conn.commit()
+
+    def _fetchone(self, sql: str, params: tuple):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    def _write(self, sql: str, rows: list[tuple]):
+        with self._lock, self._conn:
+            self._conn.executemany(sql, rows)
+
+    def load_all_user_configs(self) -> dict[int, dict]:
+        with self._lock:
+            rows = self._conn.execute("SELECT user_id, data FROM user_config").fetchall()
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    def save_user_configs(self, configs: dict[int, dict]):
+        self._write("INSERT OR REPLACE INTO user_config (user_id, data) VALUES (?, ?)",
+                    [(int(user_id), json.dumps(data)) for user_id, data in configs.items()])
+
+    def get_plugin_config(self, user_id, plugin_id: str) -> Optional[Any]:
+        row = self._fetchone("SELECT data FROM plugin_config WHERE user_id = ? AND plugin_id = ?",
+                             (str(user_id), plugin_id))
+        return json.loads(row[0]) if row else None
+
+    def save_plugin_config(self, user_id, plugin_id: str, data: Any):
+        self._write("INSERT OR REPLACE INTO plugin_config (user_id, plugin_id, data) VALUES (?, ?, ?)",
+                    [(str(user_id), plugin_id, json.dumps(data))])
+
+    def get_style(self, user_id: int) -> Optional[str]:
+        row = self._fetchone("SELECT style FROM user_style WHERE user_id = ?", (int(user_id),))
+        return row[0] if row else None
+
+    def save_style(self, user_id: int, style: str):
+        self._write("INSERT OR REPLACE INTO user_style (user_id, style) VALUES (?, ?)", [(int(user_id), style)])
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self._fetchone("SELECT value FROM meta WHERE key = ?", (key,))
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        self._write("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", [(key, value)])
+
+
+def migrate_files_to_sqlite(backend: SqliteStorage):
+    """
+    One-time import of the JSON and style files into SQLite.
+    The old files are renamed with a .migrated suffix rather than deleted.
+    """
+    if backend.get_meta("migrated_from_files"):
+        return
+
+    files = JsonStorage()
+
+    user_configs = files.load_all_user_configs()
+    if user_configs:
+        backend.save_user_configs(user_configs)
+
+    for user_id, plugin_configs in files.load_all_plugin_configs().items():
+        for plugin_id, data in plugin_configs.items():
+            backend.save_plugin_config(user_id, plugin_id, data)
+
+    styles = files.load_all_styles()
+    for user_id, style in styles.items():
+        backend.save_style(user_id, style)
+
+    backend.set_meta("migrated_from_files", "1")
+
+    for path in [USER_CONFIG_FILE, PLUGIN_CONFIG_FILE]:
+        if path.exists():
+            path.rename(path.with_name(path.name + ".migrated"))
+    if os.path.isdir(STYLE_DIR) and styles:
+        os.rename(STYLE_DIR, STYLE_DIR + ".migrated")
+
+    print(f"[Storage] Migrated {len(user_configs)} user configs and {len(styles)} styles to SQLite.")
+
+
+_backend: Optional[StorageBackend] = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> StorageBackend:
+    global _backend
+
+    with _backend_lock:
+        if _backend is None:
+            if config.STORAGE_BACKEND == "json":
+                _backend = JsonStorage()
+            else:
+                backend = SqliteStorage(DATABASE_FILE)
+                migrate_files_to_sqlite(backend)
+                _backend = backend
+
+            print(f"[Storage] Using {type(_backend).__name__}")
+
+        return _backend
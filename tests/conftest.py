@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# The bot keeps everything under config/ in the working directory and const.py reads it on import,
+# so move to a scratch directory before any of the bot's modules are loaded
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.chdir(tempfile.mkdtemp(prefix="diary-tests-"))
+
+os.environ.setdefault("WHISPER_WARM_UP", "false")
+os.environ.setdefault("METRICS_PORT", "0")
@@ -0,0 +1,44 @@
+import os
+
+import audio_preprocess
+import config
+
+MB = 1024 * 1024
+
+
+def cached_file(directory, name: str, size: int, used_at: int) -> str:
+    path = os.path.join(directory, name)
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    os.utime(path, (used_at, used_at))
+    return path
+
+
+def test_least_recently_used_files_are_evicted(tmp_path, monkeypatch):
+    monkeypatch.setattr(audio_preprocess, "AUDIO_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "AUDIO_CACHE_MAX_MB", 1)
+    (tmp_path / "1").mkdir()
+    (tmp_path / "2").mkdir()
+
+    oldest = cached_file(tmp_path / "1", "a.ogg.npy", MB // 2, used_at=1000)
+    old = cached_file(tmp_path / "2", "b.ogg.npy", MB // 2, used_at=2000)
+    recent = cached_file(tmp_path / "1", "c.ogg.npy", MB // 2, used_at=3000)
+    unrelated = cached_file(tmp_path / "1", "c.ogg.npy.tmp", MB, used_at=0)
+
+    audio_preprocess.evict_decoded_cache()
+
+    assert not os.path.exists(oldest)
+    assert os.path.exists(old) and os.path.exists(recent) and os.path.exists(unrelated)
+
+
+def test_file_just_written_is_kept_even_if_too_big(tmp_path, monkeypatch):
+    monkeypatch.setattr(audio_preprocess, "AUDIO_CACHE_DIR", str(tmp_path))
+    monkeypatch.setattr(config, "AUDIO_CACHE_MAX_MB", 1)
+
+    other = cached_file(tmp_path, "a.ogg.npy", MB // 2, used_at=3000)
+    written = cached_file(tmp_path, "b.ogg.npy", 2 * MB, used_at=1000)
+
+    audio_preprocess.evict_decoded_cache(keep=written)
+
+    assert not os.path.exists(other)
+    assert os.path.exists(written)
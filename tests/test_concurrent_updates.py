@@ -0,0 +1,88 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import config
+import handlers
+import processes
+import transcribe
+import transcription_queue
+
+
+class StubMessage:
+    def __init__(self, chat_id: int, voice=None):
+        self.chat = SimpleNamespace(id=chat_id)
+        self.voice = voice
+
+    async def reply_text(self, text, **kwargs):
+        return StubMessage(self.chat.id)
+
+    async def edit_text(self, text, **kwargs):
+        pass
+
+    async def reply_document(self, document, **kwargs):
+        pass
+
+
+class StubFile:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def download_as_bytearray(self):
+        return bytearray(self.data)
+
+    async def download_to_drive(self, path):
+        with open(path, "wb") as f:
+            f.write(self.data)
+
+
+class StubBot:
+    async def get_file(self, file_id):
+        return StubFile(file_id.encode())
+
+
+def voice_update(user_id: int, content: str):
+    message = StubMessage(user_id, voice=SimpleNamespace(file_id=content, duration=5))
+    return SimpleNamespace(message=message, effective_user=SimpleNamespace(id=user_id))
+
+
+def test_slow_transcription_does_not_block_other_updates(monkeypatch):
+    release_slow = threading.Event()
+    finished = []
+
+    def blocking_transcriber(file_path, model_size=None, data=None):
+        # Holds its worker thread the way a long Whisper run does
+        if data == b"slow":
+            release_slow.wait(timeout=10)
+        return f"transcript of {data.decode()}"
+
+    async def record_diary(reporter, audio_path, transcription_path, **kwargs):
+        finished.append(reporter.user_id)
+
+    monkeypatch.setattr(config, "TRANSCRIBE_STREAMING", False)
+    monkeypatch.setattr(config, "TRANSCRIBE_EXECUTOR", "thread")
+    monkeypatch.setattr(config, "TRANSCRIBE_WORKERS", 2)
+    monkeypatch.setattr(transcribe, "transcribe_voice", blocking_transcriber)
+    monkeypatch.setattr(transcription_queue, "_queue", None)
+    monkeypatch.setattr(processes, "transcribed_file_to_diary", record_diary)
+
+    async def run():
+        context = SimpleNamespace(bot=StubBot())
+        slow = asyncio.create_task(handlers.handle_voice(voice_update(1, "slow"), context))
+        await asyncio.sleep(0.1)
+        fast = asyncio.create_task(handlers.handle_voice(voice_update(2, "fast"), context))
+
+        # The quick note gets all the way through while the slow one is still transcribing
+        await asyncio.wait_for(fast, timeout=5)
+        assert not slow.done()
+
+        release_slow.set()
+        await asyncio.wait_for(slow, timeout=5)
+
+    try:
+        asyncio.run(run())
+    finally:
+        release_slow.set()
+        transcribe.shutdown_executor()
+
+    assert finished == [2, 1]
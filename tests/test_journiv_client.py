@@ -0,0 +1,148 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+from aiohttp import web
+
+from plugins.journiv_api import JournivClient, UPLOAD_CHUNK_SIZE
+
+EMAIL = "diary@example.com"
+PASSWORD = "hunter2"
+
+
+class FakeJourniv:
+    """
+    The Journiv endpoints the client uses, counting logins and refreshes. Tokens in `revoked` get a 401.
+    """
+
+    def __init__(self):
+        self.logins = 0
+        self.refreshes = 0
+        self.tokens_seen: list[str] = []
+        self.revoked: set[str] = set()
+        self.uploads: list[dict] = []
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post("/api/v1/auth/login", self.login)
+        app.router.add_post("/api/v1/auth/refresh", self.refresh)
+        app.router.add_get("/api/v1/journals/", self.journals)
+        app.router.add_post("/api/v1/media/upload", self.upload)
+        return app
+
+    def _issue(self, data: dict) -> web.Response:
+        data.update(expires_in=3600)
+        return web.json_response(data)
+
+    def _authorised(self, request: web.Request) -> bool:
+        token = request.headers.get("Authorization", "").removeprefix("Bearer ")
+        self.tokens_seen.append(token)
+        return token not in self.revoked
+
+    async def login(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if body != {"email": EMAIL, "password": PASSWORD}:
+            return web.Response(status=401)
+
+        self.logins += 1
+        return self._issue({"access_token": f"access-login-{self.logins}", "refresh_token": "refresh-1"})
+
+    async def refresh(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if body.get("refresh_token") != "refresh-1":
+            return web.Response(status=401)
+
+        self.refreshes += 1
+        return self._issue({"access_token": f"access-refresh-{self.refreshes}"})
+
+    async def journals(self, request: web.Request) -> web.Response:
+        if not self._authorised(request):
+            return web.Response(status=401)
+        return web.json_response([{"id": "journal-1", "name": "Diary"}])
+
+    async def upload(self, request: web.Request) -> web.Response:
+        if not self._authorised(request):
+            return web.Response(status=401)
+
+        upload = {"transfer_encoding": request.headers.get("Transfer-Encoding")}
+        reader = await request.multipart()
+        async for part in reader:
+            if part.name == "file":
+                upload.update(filename=part.filename, content_type=part.headers.get("Content-Type"),
+                              content=bytes(await part.read()))
+            else:
+                upload[part.name] = await part.text()
+
+        self.uploads.append(upload)
+        return web.json_response({"id": "media-1"})
+
+
+@asynccontextmanager
+async def journiv_server():
+    fake = FakeJourniv()
+    runner = web.AppRunner(fake.app())
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+
+    client = JournivClient(f"http://127.0.0.1:{port}/")
+    try:
+        yield fake, client
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+
+def test_token_is_reused_across_calls():
+    async def run():
+        async with journiv_server() as (fake, client):
+            for _ in range(3):
+                journals = await client.authorized(EMAIL, PASSWORD, client.load_journals)
+                assert journals[0]["id"] == "journal-1"
+
+            assert fake.logins == 1
+            assert fake.refreshes == 0
+            assert fake.tokens_seen == ["access-login-1"] * 3
+
+    asyncio.run(run())
+
+
+def test_401_refreshes_the_token_once():
+    async def run():
+        async with journiv_server() as (fake, client):
+            await client.authorized(EMAIL, PASSWORD, client.load_journals)
+
+            # Journiv stops accepting the cached token before it says it expires
+            fake.revoked.add("access-login-1")
+            await client.authorized(EMAIL, PASSWORD, client.load_journals)
+            await client.authorized(EMAIL, PASSWORD, client.load_journals)
+
+            assert fake.logins == 1
+            assert fake.refreshes == 1
+            assert fake.tokens_seen == ["access-login-1", "access-login-1", "access-refresh-1", "access-refresh-1"]
+
+    asyncio.run(run())
+
+
+def test_media_upload_is_streamed(tmp_path):
+    voice_note = tmp_path / "12_05_2024_08_30_1715499000.ogg"
+    content = os.urandom(UPLOAD_CHUNK_SIZE * 3 + 123)
+    voice_note.write_bytes(content)
+
+    async def run():
+        async with journiv_server() as (fake, client):
+            response = await client.authorized(
+                EMAIL, PASSWORD,
+                lambda token: client.upload_media(token, str(voice_note), entry_id="entry-1"))
+
+            assert response == {"id": "media-1"}
+            upload, = fake.uploads
+            assert upload["content"] == content
+            assert upload["filename"] == voice_note.name
+            assert upload["content_type"] == "audio/ogg"
+            assert upload["entry_id"] == "entry-1"
+            # Sent as it's read rather than loaded up front with a Content-Length
+            assert upload["transfer_encoding"] == "chunked"
+
+    asyncio.run(run())
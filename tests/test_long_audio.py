@@ -0,0 +1,64 @@
+from long_audio import Chunk, SAMPLE_RATE, content_spans, kept_text, plan_chunks, stitch
+
+
+def seconds(start: float, end: float) -> tuple[int, int]:
+    return int(start * SAMPLE_RATE), int(end * SAMPLE_RATE)
+
+
+def test_spans_are_packed_into_chunks_at_the_pauses():
+    speech = [seconds(0, 20), seconds(22, 45), seconds(50, 70), seconds(71, 90)]
+
+    chunks = plan_chunks(speech, seconds(0, 90)[1], chunk_samples=50 * SAMPLE_RATE, overlap_samples=2 * SAMPLE_RATE)
+
+    assert [chunk.spans for chunk in chunks] == [speech[:2], speech[2:]]
+    # Cut at a pause, so nothing is transcribed twice and every segment is kept
+    assert all(chunk.keep_from == 0 and chunk.keep_to == float("inf") for chunk in chunks)
+
+
+def test_keeping_the_silence_cuts_halfway_through_each_pause():
+    speech = [seconds(1, 20), seconds(22, 45)]
+
+    assert content_spans(speech, seconds(0, 50)[1], keep_silence=True) == [seconds(0, 21), seconds(21, 50)]
+    assert content_spans(speech, seconds(0, 50)[1], keep_silence=False) == speech
+
+
+def test_speech_without_pauses_is_cut_with_overlap():
+    total = seconds(0, 100)[1]
+
+    chunks = plan_chunks([(0, total)], total, chunk_samples=40 * SAMPLE_RATE, overlap_samples=2 * SAMPLE_RATE)
+
+    assert [chunk.spans for chunk in chunks] == [[seconds(0, 42)], [seconds(38, 82)], [seconds(78, 100)]]
+    assert [(chunk.keep_from, chunk.keep_to) for chunk in chunks] == [(0, 40), (2, 42), (2, 22)]
+
+
+def test_overlap_is_dropped_when_stitching():
+    total = seconds(0, 100)[1]
+    first, second, third = plan_chunks([(0, total)], total, chunk_samples=40 * SAMPLE_RATE,
+                                       overlap_samples=2 * SAMPLE_RATE)
+
+    # (start, end, text) in seconds into each chunk, as Whisper returns them. Each chunk also hears the
+    # words either side of its cut, which belong to its neighbour.
+    pieces = [
+        kept_text(first, [(0.0, 20.0, " Today I went"), (20.0, 39.0, " to the market."),
+                          (39.5, 42.0, " Then I")]),
+        kept_text(second, [(0.0, 1.5, " to the market."), (1.5, 20.0, " Then I"),
+                           (20.0, 41.0, " walked home."), (41.5, 44.0, " It rained")]),
+        kept_text(third, [(0.0, 1.8, " walked home."), (1.8, 22.0, " It rained.")]),
+    ]
+
+    assert pieces == [["Today I went", "to the market."], ["Then I", "walked home."], ["It rained."]]
+    assert stitch(pieces) == "Today I went to the market. Then I walked home. It rained."
+
+
+def test_segment_repeated_across_a_cut_is_kept_once():
+    # Whisper's timestamps drifted, so both chunks kept the sentence on the cut
+    assert stitch([["Today I went", "to the market."], ["To the market!", "Then I walked home."]]) == \
+        "Today I went to the market. Then I walked home."
+    assert stitch([["One."], [], ["Two."]]) == "One. Two."
+
+
+def test_chunk_without_overlap_keeps_everything():
+    chunk = Chunk(spans=[seconds(0, 30)])
+
+    assert kept_text(chunk, [(0.0, 10.0, " Hello"), (10.0, 30.0, " there "), (29.0, 30.0, "  ")]) == \
+        ["Hello", "there"]
@@ -0,0 +1,44 @@
+import asyncio
+import os
+import runpy
+
+import config
+import transcribe
+import transcription_queue
+from conftest import REPO_ROOT
+
+
+def import_bot_as_worker() -> tuple[int, int]:
+    """
+    Loads bot.py the way a spawned pool worker loads the parent's main module, and counts how often it
+    tried to start polling.
+    """
+    from telegram.ext import Application
+
+    polled = []
+    Application.run_polling = lambda self, *args, **kwargs: polled.append(self)
+    runpy.run_path(os.path.join(REPO_ROOT, "bot.py"), run_name="__mp_main__")
+    return os.getpid(), len(polled)
+
+
+def test_process_workers_do_not_start_the_bot(monkeypatch):
+    monkeypatch.setattr(config, "TRANSCRIBE_EXECUTOR", "process")
+    monkeypatch.setattr(config, "TRANSCRIBE_WORKERS", 1)
+    monkeypatch.setattr(config, "WHISPER_WARM_UP", False)
+    monkeypatch.setattr(transcribe, "_executor", None)
+    monkeypatch.setattr(transcription_queue, "_queue", None)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        future, position = transcription_queue.get_queue().submit(
+            1, lambda: loop.run_in_executor(transcribe.get_executor(), import_bot_as_worker))
+        assert position == 0
+        return await asyncio.wait_for(future, timeout=60)
+
+    try:
+        pid, polled = asyncio.run(run())
+    finally:
+        transcribe.shutdown_executor()
+
+    assert pid != os.getpid()
+    assert polled == 0
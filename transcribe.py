@@ -1,12 +1,216 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Awaitable, Callable, Optional
+
+import numpy as np
 from faster_whisper import WhisperModel
 
-# Load once globally
-model = WhisperModel("base", device="cpu", compute_type="int8")  # You can use "medium", "large", etc.
+import config
+import long_audio
+from audio_preprocess import preprocess
+
+# Loaded models by size, shared by every worker thread in this process
+_models: dict[str, WhisperModel] = {}
+_models_lock = threading.Lock()
+
+_executor: Optional[Executor] = None
+
+
+def get_model(model_size: Optional[str] = None) -> WhisperModel:
+    """
+    Returns the Whisper model for the given size, loading it the first time it's asked for.
+    Defaults to WHISPER_MODEL.
+    """
+    model_size = model_size or config.WHISPER_MODEL
+
+    with _models_lock:
+        if model_size not in _models:
+            print(f"[Transcribe] Loading Whisper model '{model_size}' ({config.WHISPER_COMPUTE_TYPE})")
+            _models[model_size] = WhisperModel(model_size,
+                                               device=config.WHISPER_DEVICE,
+                                               compute_type=config.WHISPER_COMPUTE_TYPE,
+                                               cpu_threads=config.WHISPER_CPU_THREADS,
+                                               num_workers=config.WHISPER_NUM_WORKERS)
+        return _models[model_size]
 
 
-def transcribe_voice(file_path: str) -> str:
-    segments, _ = model.transcribe(file_path)
+def warm_up():
+    get_model()
+
+
+def _has_speech(audio) -> bool:
+    # preprocess() hands back an empty array when the VAD found nothing to transcribe
+    return not isinstance(audio, np.ndarray) or audio.size > 0
+
+
+def transcribe_voice(file_path: str, model_size: Optional[str] = None, data: Optional[bytes] = None) -> str:
+    """
+    Transcribes the voice note at file_path, or from `data` if its contents are already in memory.
+    """
+    audio = preprocess(file_path, data)
+    if not _has_speech(audio):
+        return ""
+
+    segments, _ = get_model(model_size).transcribe(audio)
     result = []
     for segment in segments:
         result.append(segment.text)
     return " ".join(result)
+
+
+def get_executor() -> Executor:
+    """
+    Returns the shared transcription pool, creating it on first use.
+    """
+    global _executor
+
+    if _executor is None:
+        if config.TRANSCRIBE_EXECUTOR == "process":
+            # Spawn rather than fork so each worker loads its own copy of the model
+            _executor = ProcessPoolExecutor(max_workers=config.TRANSCRIBE_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=warm_up if config.WHISPER_WARM_UP else None)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=config.TRANSCRIBE_WORKERS,
+                                           thread_name_prefix="transcribe")
+
+        print(f"[Transcribe] Started {config.TRANSCRIBE_EXECUTOR} pool with {config.TRANSCRIBE_WORKERS} workers")
+
+    return _executor
+
+
+async def warm_up_async():
+    """
+    Loads the default model on the pool in the background so the first voice note doesn't pay for it.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(get_executor(), warm_up)
+        print("[Transcribe] Whisper model warmed up")
+    except Exception as e:
+        print(f"[Transcribe] Warm up failed: {e}")
+
+
+def transcribe_chunk(pcm_path: str, chunk: long_audio.Chunk, model_size: Optional[str] = None) -> list[str]:
+    segments, _ = get_model(model_size).transcribe(long_audio.chunk_audio(pcm_path, chunk))
+    return long_audio.kept_text(chunk, [(segment.start, segment.end, segment.text) for segment in segments])
+
+
+async def _transcribe_chunked(file_path: str, model_size: Optional[str],
+                              on_text: Optional[Callable[[str], Awaitable]] = None) -> Optional[str]:
+    """
+    Transcribes a note longer than LONG_AUDIO_SECONDS as chunks spread across the pool, calling on_text
+    with the transcript so far as each chunk finishes in order. Returns None for shorter notes, and when
+    the pool couldn't run the chunks in parallel anyway.
+    """
+    if not long_audio.enabled():
+        return None
+
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+
+    plan = await loop.run_in_executor(executor, long_audio.plan, file_path)
+    if plan is None:
+        return None
+
+    jobs = [loop.run_in_executor(executor, transcribe_chunk, plan.pcm_path, chunk, model_size)
+            for chunk in plan.chunks]
+
+    pieces = []
+    try:
+        for job in jobs:
+            pieces.append(await job)
+            text = long_audio.stitch(pieces)
+            if on_text is not None and text:
+                await on_text(text)
+    except BaseException:
+        # Don't leave the rest of the chunks taking up the pool
+        for job in jobs:
+            job.cancel()
+        raise
+    finally:
+        if plan.temporary:
+            os.remove(plan.pcm_path)
+
+    return long_audio.stitch(pieces)
+
+
+async def transcribe_voice_async(file_path: str, model_size: Optional[str] = None,
+                                 data: Optional[bytes] = None) -> str:
+    """
+    Runs transcribe_voice on the transcription pool so the event loop keeps serving other updates.
+    Notes transcribed from memory are never split, the chunk workers read the file.
+    """
+    if data is None:
+        text = await _transcribe_chunked(file_path, model_size)
+        if text is not None:
+            return text
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), transcribe_voice, file_path, model_size, data)
+
+
+def _stream_segments(file_path: str, model_size: Optional[str], data: Optional[bytes],
+                     loop: asyncio.AbstractEventLoop, segment_queue: asyncio.Queue):
+    try:
+        audio = preprocess(file_path, data)
+        if not _has_speech(audio):
+            return
+
+        segments, _ = get_model(model_size).transcribe(audio)
+        for segment in segments:
+            loop.call_soon_threadsafe(segment_queue.put_nowait, segment.text)
+    finally:
+        loop.call_soon_threadsafe(segment_queue.put_nowait, None)
+
+
+async def transcribe_voice_streaming(file_path: str, on_text: Callable[[str], Awaitable],
+                                     model_size: Optional[str] = None, data: Optional[bytes] = None) -> str:
+    """
+    Transcribes on the pool like transcribe_voice_async, but calls on_text with the transcript
+    so far after every segment.
+
+    Generators can't be sent back from a worker process, so with the process pool this falls
+    back to a single on_text call once the whole note is done. Long notes are updated a chunk at a time.
+    """
+    if data is None:
+        text = await _transcribe_chunked(file_path, model_size, on_text)
+        if text is not None:
+            return text
+
+    executor = get_executor()
+    loop = asyncio.get_running_loop()
+
+    if isinstance(executor, ProcessPoolExecutor):
+        text = await loop.run_in_executor(executor, transcribe_voice, file_path, model_size, data)
+        await on_text(text)
+        return text
+
+    segment_queue = asyncio.Queue()
+    worker = loop.run_in_executor(executor, _stream_segments, file_path, model_size, data, loop,
+                                  segment_queue)
+
+    result = []
+    while True:
+        segment_text = await segment_queue.get()
+        if segment_text is None:
+            break
+
+        result.append(segment_text)
+        await on_text(" ".join(result))
+
+    # Surfaces any error raised inside the worker
+    await worker
+
+    return " ".join(result)
+
+
+def shutdown_executor():
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import audio_preprocess
+import config
+from const import CONFIG_PATH
+
+CACHE_INDEX_FILE = Path(CONFIG_PATH + "/transcription_cache.json")
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+class TranscriptionCache:
+    """
+    Maps audio content + model settings to a transcription file already written under TRANSCRIPTION_DIR.
+
+    The index is kept in memory in least-recently-used order and saved to `index_file` on every change.
+    Once it holds more than `max_entries` keys the oldest are dropped. Only index entries are evicted,
+    the transcription files themselves are left alone.
+    """
+
+    def __init__(self, index_file: Path, max_entries: int):
+        self.index_file = index_file
+        self.max_entries = max_entries
+
+        self._entries: Optional["OrderedDict[str, str]"] = None
+        self._lock = threading.Lock()
+
+        # Keys currently being transcribed, so duplicate deliveries of the same note are dropped
+        self.in_flight: set[str] = set()
+
+    @staticmethod
+    def make_key(user_id: int, audio_hash: str, model_size: Optional[str]) -> str:
+        model_size = model_size or config.WHISPER_MODEL
+        return f"{user_id}:{audio_hash}:{model_size}:{config.WHISPER_COMPUTE_TYPE}:{audio_preprocess.settings_key()}"
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entries = self._load()
+            path = entries.get(key)
+            if path is None:
+                return None
+
+            if not os.path.exists(path):
+                del entries[key]
+                self._save()
+                return None
+
+            entries.move_to_end(key)
+            return path
+
+    def put(self, key: str, transcription_path: str):
+        with self._lock:
+            entries = self._load()
+            entries[key] = transcription_path
+            entries.move_to_end(key)
+
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+
+            self._save()
+
+    def _load(self) -> "OrderedDict[str, str]":
+        if self._entries is None:
+            self._entries = OrderedDict()
+
+            if self.index_file.exists():
+                try:
+                    self._entries.update(json.loads(self.index_file.read_text()))
+                except json.JSONDecodeError:
+                    print("[TranscriptionCache] Index corrupted, starting empty")
+
+        return self._entries
+
+    def _save(self):
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.index_file.with_suffix(".tmp")
+        tmp_file.write_text(json.dumps(self._entries))
+        os.replace(tmp_file, self.index_file)
+
+
+cache = TranscriptionCache(CACHE_INDEX_FILE, max_entries=config.TRANSCRIPTION_CACHE_SIZE)
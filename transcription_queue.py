@@ -0,0 +1,187 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Optional
+
+import config
+import metrics
+
+
+QUEUE_WAIT_SECONDS = metrics.Histogram("diary_transcription_queue_wait_seconds",
+                                       "Time transcription jobs wait in the queue before starting")
+QUEUE_JOBS = metrics.Counter("diary_transcription_jobs_total", "Transcription jobs by outcome", labels=("result",))
+metrics.Gauge("diary_transcription_queue_depth", "Transcription jobs waiting to start",
+              function=lambda: _queue.depth() if _queue else 0)
+metrics.Gauge("diary_transcription_in_flight", "Transcription jobs running now",
+              function=lambda: _queue.in_flight if _queue else 0)
+
+
+class QueueFullError(Exception):
+    pass
+
+
+@dataclass
+class QueueJob:
+    user_id: int
+    run: Callable[[], Awaitable]
+    future: asyncio.Future
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class TranscriptionQueue:
+    """
+    Global job queue in front of the transcription pool.
+
+    At most `concurrency` jobs run at once. Waiting jobs are handed out round-robin across
+    user IDs, so one user sending ten notes doesn't hold everyone else up. Once `max_depth`
+    jobs are waiting, new submissions are rejected with QueueFullError.
+    """
+
+    def __init__(self, concurrency: int, max_depth: int):
+        self.concurrency = concurrency
+        self.max_depth = max_depth
+
+        # user_id -> that user's waiting jobs. Order of keys is the round-robin order.
+        self._pending: "OrderedDict[int, deque[QueueJob]]" = OrderedDict()
+        self._condition = asyncio.Condition()
+        self._workers: list[asyncio.Task] = []
+        # Wake-ups handed to the workers, kept so they aren't garbage collected and their errors get seen
+        self._notify_tasks: set[asyncio.Task] = set()
+
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._wait_times: deque[float] = deque(maxlen=200)
+
+    def depth(self) -> int:
+        return sum(len(jobs) for jobs in self._pending.values())
+
+    def submit(self, user_id: int, run: Callable[[], Awaitable]) -> tuple[asyncio.Future, int]:
+        """
+        Queue a job for the user.
+
+        Returns the future for the job's result and its position in the queue.
+        Position is 0 when the job will start straight away.
+        """
+        if self.depth() >= self.max_depth:
+            self.rejected += 1
+            QUEUE_JOBS.inc(result="rejected")
+            raise QueueFullError(f"Transcription queue is full ({self.max_depth} waiting)")
+
+        self._ensure_workers()
+
+        job = QueueJob(user_id=user_id, run=run, future=asyncio.get_running_loop().create_future())
+        self._pending.setdefault(user_id, deque()).append(job)
+
+        # The first jobs in line go straight to idle workers, they aren't waiting
+        idle_workers = self.concurrency - self.in_flight
+        position = max(0, self._position(job) - idle_workers)
+
+        notify = asyncio.create_task(self._notify())
+        self._notify_tasks.add(notify)
+        notify.add_done_callback(self._notify_done)
+
+        return job.future, position
+
+    def stats(self) -> dict:
+        waits = sorted(self._wait_times)
+
+        return {
+            "depth": self.depth(),
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "wait_avg": sum(waits) / len(waits) if waits else 0.0,
+            "wait_p95": waits[int(len(waits) * 0.95) - 1] if waits else 0.0,
+            "wait_max": waits[-1] if waits else 0.0,
+        }
+
+    def _position(self, job: QueueJob) -> int:
+        """
+        Where the job sits in the round-robin order, counting from 1, including jobs about to start.
+        """
+        turn = self._pending[job.user_id].index(job) + 1
+        position = 0
+        before_user = True
+
+        for user_id, jobs in self._pending.items():
+            if user_id == job.user_id:
+                position += turn
+                before_user = False
+            elif before_user:
+                position += min(len(jobs), turn)
+            else:
+                position += min(len(jobs), turn - 1)
+
+        return position
+
+    def _pop_next(self) -> QueueJob:
+        user_id, jobs = next(iter(self._pending.items()))
+        job = jobs.popleft()
+
+        if jobs:
+            # Send this user to the back of the rotation
+            self._pending.move_to_end(user_id)
+        else:
+            del self._pending[user_id]
+
+        return job
+
+    async def _notify(self):
+        async with self._condition:
+            self._condition.notify()
+
+    def _notify_done(self, task: asyncio.Task):
+        self._notify_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"[TranscriptionQueue] Failed to wake a worker: {task.exception()}")
+
+    def _ensure_workers(self):
+        self._workers = [w for w in self._workers if not w.done()]
+
+        while len(self._workers) < self.concurrency:
+            self._workers.append(asyncio.create_task(self._worker()))
+
+    async def _worker(self):
+        while True:
+            async with self._condition:
+                await self._condition.wait_for(lambda: self._pending)
+                job = self._pop_next()
+
+            if job.future.cancelled():
+                continue
+
+            self._wait_times.append(time.monotonic() - job.enqueued_at)
+            QUEUE_WAIT_SECONDS.observe(self._wait_times[-1])
+            self.in_flight += 1
+
+            try:
+                result = await job.run()
+            except Exception as e:
+                self.failed += 1
+                QUEUE_JOBS.inc(result="failed")
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                self.completed += 1
+                QUEUE_JOBS.inc(result="completed")
+                if not job.future.done():
+                    job.future.set_result(result)
+            finally:
+                self.in_flight -= 1
+
+
+_queue: Optional[TranscriptionQueue] = None
+
+
+def get_queue() -> TranscriptionQueue:
+    global _queue
+
+    if _queue is None:
+        _queue = TranscriptionQueue(concurrency=config.TRANSCRIBE_WORKERS,
+                                    max_depth=config.TRANSCRIBE_QUEUE_DEPTH)
+
+    return _queue
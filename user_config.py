@@ -1,18 +1,24 @@
-import json
-from dataclasses import dataclass, asdict
-from pathlib import Path
-from typing import Optional, Dict
+import asyncio
+import atexit
+import threading
+from dataclasses import dataclass, asdict, replace
+from typing import Optional, Dict, Callable
 
-from const import CONFIG_PATH
-
-USER_CONFIG_FILE = Path(CONFIG_PATH + "/user_config.json")
-USER_CONFIG_FILE.parent.mkdir(parents=True, exist_ok=True)
+import config
+import storage
 
 
 @dataclass
 class UserConfig:
     ai_enabled: bool
     reminder_time: Optional[str]
+    whisper_model: Optional[str] = None
+    # IANA time zone name for reminders, None uses the bot's local time
+    timezone: Optional[str] = None
+
+    @classmethod
+    def default(cls) -> "UserConfig":
+        return cls(ai_enabled=True, reminder_time=None)
 
     @classmethod
     def from_dict(cls, data: dict) -> "UserConfig":
@@ -22,47 +28,125 @@ class UserConfig:
         return asdict(self)
 
 
-def load_all_configs() -> dict[int, UserConfig]:
-    if not USER_CONFIG_FILE.exists():
-        return {}
+"""
+In-memory store. The storage backend is read once, reads are served from memory and changed
+users are written back in the background a short while after the last save.
+"""
+_configs: Optional[Dict[int, UserConfig]] = None
+_dirty: set[int] = set()
+_flush_handle: Optional[asyncio.TimerHandle] = None
 
-    try:
-        raw = json.loads(USER_CONFIG_FILE.read_text())
-    except json.JSONDecodeError:
-        return {}
+# Guards _configs/_dirty. Held only for in-memory work, never for storage I/O.
+_lock = threading.RLock()
+# Serialises the first load so storage is only read once
+_load_lock = threading.Lock()
+# Serialises writers so an older snapshot can never overwrite a newer one
+_write_lock = threading.Lock()
 
-    result = {}
 
-    for user_id_str, data in raw.items():
-        result[int(user_id_str)] = UserConfig.from_dict(data)
+def _store() -> Dict[int, UserConfig]:
+    """
+    The loaded configs. Call it before taking _lock, the first call reads the storage backend.
+    """
+    global _configs
 
-    return result
+    if _configs is None:
+        with _load_lock:
+            if _configs is None:
+                raw = storage.get_backend().load_all_user_configs()
+                configs = {user_id: UserConfig.from_dict(data) for user_id, data in raw.items()}
+                with _lock:
+                    _configs = configs
+    return _configs
 
 
-def load_user_config(user_id: int) -> UserConfig:
-    cfg = load_all_configs()
-    return cfg.get(user_id)
+def load_all_configs() -> dict[int, UserConfig]:
+    store = _store()
+    with _lock:
+        # Copies, so callers can change them without touching the store until they save
+        return {user_id: replace(cfg) for user_id, cfg in store.items()}
 
 
-def save_all_configs(cfg: dict):
-    USER_CONFIG_FILE.write_text(json.dumps(cfg, indent=2))
+def load_user_config(user_id: int) -> UserConfig:
+    store = _store()
+    with _lock:
+        cfg = store.get(user_id)
+        return replace(cfg) if cfg else UserConfig.default()
 
 
 def save_user_config(user_id: int, config: UserConfig):
     """
     Save a single user's config.
 
-    load_all_configs() returns: dict[int, UserConfig]
-    save_all_configs() expects: dict[str, dict]  (serialisable)
+    The store is updated straight away, storage is written behind. See flush().
     """
-    # Load the in-memory map of UserConfig objects
-    all_cfgs: Dict[int, UserConfig] = load_all_configs()
+    store = _store()
+    with _lock:
+        store[user_id] = replace(config)
+        _dirty.add(user_id)
+
+    _schedule_flush()
 
-    # Convert existing objects to serialisable dicts with string keys
-    serialisable = {uid: cfg_obj.to_dict() for uid, cfg_obj in all_cfgs.items()}
 
-    # Insert/update this user's config (use the provided config dataclass)
-    serialisable[user_id] = config.to_dict()
+def update_user_config(user_id: int, change: Callable[[UserConfig], None]) -> UserConfig:
+    """
+    Read-modify-write a single user's config in one step, so concurrent changes to
+    different fields of the same user don't overwrite each other.
+    """
+    store = _store()
+    with _lock:
+        cfg = replace(store.get(user_id) or UserConfig.default())
+        change(cfg)
+        store[user_id] = cfg
+        _dirty.add(user_id)
+
+    _schedule_flush()
 
-    # Persist to disk
-    save_all_configs(serialisable)
+    return replace(cfg)
+
+
+def _schedule_flush():
+    global _flush_handle
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # No event loop (startup, migrations, scripts) so just write now
+        flush()
+        return
+
+    with _lock:
+        if _flush_handle is None:
+            _flush_handle = loop.call_later(config.USER_CONFIG_FLUSH_DELAY, _flush_in_background, loop)
+
+
+def _flush_in_background(loop: asyncio.AbstractEventLoop):
+    global _flush_handle
+
+    with _lock:
+        _flush_handle = None
+
+    loop.run_in_executor(None, flush)
+
+
+def flush():
+    """
+    Write changed users to the storage backend. Safe to call at any time and from any thread.
+    """
+    with _write_lock:
+        with _lock:
+            # Nothing is dirty until the store has been loaded
+            if not _dirty:
+                return
+            changes = {user_id: _configs[user_id].to_dict() for user_id in _dirty}
+            _dirty.clear()
+
+        try:
+            storage.get_backend().save_user_configs(changes)
+        except Exception as e:
+            with _lock:
+                _dirty.update(changes.keys())
+            print(f"[UserConfig] Failed to write user config: {e}")
+
+
+atexit.register(flush)